@@ -0,0 +1,416 @@
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+
+import numpy as np
+
+from main import read_pattern
+
+
+#
+# Analysis
+#
+# Ingestion turns the text logs of every run into one columnar store:
+#
+#   runs/<id>/generations.csv     every generation of newer runs
+#   data/<id>_<ff>.cvs            generation,tileset_size_limit every
+#                                 data_every generations, also the legacy runs
+#   notable_runs/<id>/            the best organism of each population dump
+#
+# together with the _info.txt next to them. Each run becomes one .npz part of
+# column arrays under analysis/ff=<ff>/pattern=<pattern>/, so queries only
+# open the partitions they ask for. A manifest records the size and mtime of
+# every source, and ingesting again only parses what changed; a store of an
+# older STORE_VERSION is rebuilt. Values a source does not have are -1, or NaN
+# for seconds; ff and pattern are "unknown" and pattern_size -1 when no
+# _info.txt says.
+#
+STORE_VERSION = 2
+
+COLUMNS = ("generation", "best_score", "tileset_size", "incorrect",
+           "tileset_size_limit", "seconds")
+METADATA = ("run_id", "ff", "pattern", "pattern_size", "source",
+            "population_size", "mutation_rate", "random_seed", "stop_reason")
+
+GENERATION_LINE = re.compile(r"\*\*\* Generation (\d+) \*\*\*")
+SCORE_LINE = re.compile(r"Score: (-?\d+)")
+INCORRECT_LINE = re.compile(r"Incorrectly placed tiles: (\d+)")
+TILE_LINE = re.compile(r"\(\d+, \d+, \d+, \d+\): ")
+
+
+# _info.txt as a dict of its "Key: value" lines, the pattern cells under
+# "pattern"
+def read_info(path):
+    info = {}
+    with open(path, "r") as f:
+        lines = f.read().splitlines()
+    for i, line in enumerate(lines):
+        if line == "Pattern:":
+            cells = []
+            for row in lines[i + 1:]:
+                if not row.strip():
+                    break
+                cells.extend(row.split())
+            info["pattern"] = cells
+        elif ": " in line:
+            key, value = line.split(": ", 1)
+            info.setdefault(key, value)
+    return info
+
+
+def find_info(run_id, directories):
+    for directory in directories:
+        path = os.path.join(directory, run_id, "_info.txt")
+        if os.path.exists(path):
+            return read_info(path)
+    return {}
+
+
+# Patterns are named after the file in patterns/ holding the same cells,
+# others after their size and a hash of the cells
+def pattern_names(directory="patterns"):
+    return {tuple(read_pattern(path)): os.path.splitext(os.path.basename(path))[0]
+            for path in sorted(glob.glob(os.path.join(directory, "*.txt")))}
+
+
+def pattern_name(cells, names):
+    if not cells:
+        return "unknown"
+    if tuple(cells) in names:
+        return names[tuple(cells)]
+    size = int(len(cells) ** 0.5)
+    digest = hashlib.sha1(" ".join(cells).encode()).hexdigest()[:8]
+    return f"{size}x{size}-{digest}"
+
+
+def metadata(run_id, ff, source, info, names):
+    return {
+        "run_id": run_id,
+        "ff": info.get("Fitness function", ff),
+        "pattern": pattern_name(info.get("pattern"), names),
+        "pattern_size": int(len(info["pattern"]) ** 0.5) if info.get("pattern") else -1,
+        "source": source,
+        "population_size": int(info.get("Population size", -1)),
+        "mutation_rate": float(info.get("Mutation rate", "nan")),
+        "random_seed": int(info.get("Random seed", -1)),
+        "stop_reason": info.get("Stop reason", ""),
+    }
+
+
+def empty_columns(rows):
+    result = {name: np.full(rows, -1, dtype=np.int64) for name in COLUMNS}
+    result["seconds"] = np.full(rows, np.nan)
+    return result
+
+
+#
+# Readers
+#
+# Each takes the files of one source and returns its column arrays
+#
+def read_generations_csv(path):
+    with open(path, "r") as f:
+        header = f.readline().strip().split(",")
+    table = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+    columns = empty_columns(len(table))
+    for i, name in enumerate(header):
+        if name in columns:
+            columns[name] = table[:, i].astype(columns[name].dtype)
+    return columns
+
+
+def read_data_cvs(path):
+    table = np.loadtxt(path, delimiter=",", dtype=np.int64, ndmin=2)
+    columns = empty_columns(len(table))
+    columns["generation"] = table[:, 0]
+    columns["tileset_size_limit"] = table[:, 1]
+    return columns
+
+
+# The header and best organism of a population dump, the rest of the file is
+# never read
+def read_population_head(path):
+    generation = score = incorrect = -1
+    tiles = 0
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("--- Population"):
+                break
+            match = GENERATION_LINE.match(line)
+            if match:
+                generation = int(match.group(1))
+            elif SCORE_LINE.match(line) and score == -1:
+                score = int(SCORE_LINE.match(line).group(1))
+            elif INCORRECT_LINE.match(line):
+                incorrect = int(INCORRECT_LINE.match(line).group(1))
+            elif TILE_LINE.match(line):
+                tiles += 1
+    return generation, score, tiles, incorrect
+
+
+def read_population_dumps(*paths):
+    rows = sorted(read_population_head(path) for path in paths)
+    columns = empty_columns(len(rows))
+    for i, name in enumerate(("generation", "best_score", "tileset_size",
+                              "incorrect")):
+        columns[name] = np.array([row[i] for row in rows], dtype=np.int64)
+    return columns
+
+
+#
+# Sources
+#
+# (source path, files whose size and mtime decide if it changed, run id, ff,
+# reader) of every run found. A data/ file is left out when the run also
+# has a generations.csv, which holds the same and more.
+#
+def find_sources(runs_dir="runs", data_dir="data", notable_dir="notable_runs"):
+    sources = []
+    covered = set()
+    for path in sorted(glob.glob(os.path.join(runs_dir, "*", "generations.csv"))):
+        run_id = os.path.basename(os.path.dirname(path))
+        covered.add(run_id)
+        sources.append((path, [path], run_id, "unknown", read_generations_csv))
+
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.cvs"))):
+        name = os.path.basename(path)[:-len(".cvs")]
+        if name.endswith("_stats") or "_ff_" not in name:
+            continue
+        run_id, ff = name.split("_ff_", 1)
+        if run_id not in covered:
+            sources.append((path, [path], run_id, "ff_" + ff, read_data_cvs))
+
+    for directory in sorted(glob.glob(os.path.join(notable_dir, "*"))):
+        dumps = sorted(glob.glob(os.path.join(directory, "*_population.txt")))
+        if dumps:
+            sources.append((directory, dumps, os.path.basename(directory),
+                            "unknown", read_population_dumps))
+    return sources
+
+
+def fingerprint(files):
+    return [[os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in files]
+
+
+#
+# Store
+#
+def manifest_path(store):
+    return os.path.join(store, "manifest.json")
+
+
+def read_manifest(store):
+    if not os.path.exists(manifest_path(store)):
+        return {}
+    with open(manifest_path(store), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != STORE_VERSION:
+        return {}
+    return manifest["sources"]
+
+
+def part_path(store, meta):
+    digest = hashlib.sha1(meta["source"].encode()).hexdigest()[:8]
+    return os.path.join(store, f"ff={meta['ff']}", f"pattern={meta['pattern']}",
+                        f"{meta['run_id']}-{digest}.npz")
+
+
+def ingest(store="analysis", runs_dir="runs", data_dir="data",
+           notable_dir="notable_runs", patterns_dir="patterns"):
+    manifest = read_manifest(store)
+    names = pattern_names(patterns_dir)
+    info_dirs = (runs_dir, notable_dir)
+    sources = find_sources(runs_dir, data_dir, notable_dir)
+
+    added = unchanged = 0
+    for source, files, run_id, ff, reader in sources:
+        stamp = fingerprint(files)
+        entry = manifest.get(source)
+        if entry is not None and entry["files"] == stamp and \
+                os.path.exists(entry["part"]):
+            unchanged += 1
+            continue
+
+        meta = metadata(run_id, ff, source, find_info(run_id, info_dirs), names)
+        path = part_path(store, meta)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, **reader(*files),
+                 **{name: np.array(value) for name, value in meta.items()})
+        if entry is not None and entry["part"] != path and \
+                os.path.exists(entry["part"]):
+            os.remove(entry["part"])
+        manifest[source] = {"files": stamp, "part": path}
+        added += 1
+
+    # sources that are gone take their parts with them
+    found = {source for source, *_ in sources}
+    removed = 0
+    for source in [source for source in manifest if source not in found]:
+        if os.path.exists(manifest[source]["part"]):
+            os.remove(manifest[source]["part"])
+        del manifest[source]
+        removed += 1
+
+    os.makedirs(store, exist_ok=True)
+    with open(manifest_path(store), "w") as f:
+        json.dump({"version": STORE_VERSION, "sources": manifest}, f, indent=1,
+                  sort_keys=True)
+    return added, unchanged, removed
+
+
+# Every run in the partitions matching ff and pattern (None for all), as a
+# dict of its columns and metadata
+def load_runs(store="analysis", ff=None, pattern=None):
+    runs = []
+    for path in sorted(glob.glob(os.path.join(
+            store, f"ff={ff or '*'}", f"pattern={pattern or '*'}", "*.npz"))):
+        with np.load(path) as part:
+            run = {name: part[name] for name in COLUMNS}
+            run.update({name: part[name].item() for name in METADATA})
+        runs.append(run)
+    return runs
+
+
+def group_runs(runs):
+    groups = {}
+    for run in runs:
+        groups.setdefault((run["ff"], run["pattern"]), []).append(run)
+    return sorted(groups.items())
+
+
+#
+# Queries
+#
+# Size of the smallest perfect tileset known at each logged row, -1 before
+# the first. tileset_size_limit starts at n²-1 before any assembly is perfect,
+# so it only counts below that. The limit never exceeds n²-1, so when the
+# pattern is unknown n is taken as the smallest that fits the first limit.
+def perfect_sizes(run):
+    limit = run["tileset_size_limit"]
+    size = run["pattern_size"]
+    if size < 0 and len(limit) and limit[0] >= 0:
+        size = math.isqrt(limit[0])
+        if size ** 2 - 1 < limit[0]:
+            size += 1
+    elif size < 0:
+        size = 0
+    initial = size ** 2 - 1
+    sizes = np.where((limit >= 0) & (limit < initial), limit, -1)
+    tileset_size = run["tileset_size"]
+    perfect = (run["incorrect"] == 0) & (tileset_size >= 0) & (
+        (sizes < 0) | (tileset_size < sizes))
+    return np.where(perfect, tileset_size, sizes)
+
+
+# First logged generation with a perfect tileset of at most size tiles, or
+# None. data/ files are written every data_every generations, so their runs
+# can only be placed to that interval.
+def generation_reached(run, size):
+    sizes = perfect_sizes(run)
+    found = np.flatnonzero((sizes >= 0) & (sizes <= size))
+    return int(run["generation"][found[0]]) if len(found) else None
+
+
+def reach_table(runs, size):
+    rows = []
+    for (ff, pattern), group in group_runs(runs):
+        generations = [g for g in (generation_reached(run, size) for run in group)
+                       if g is not None]
+        rows.append({
+            "ff": ff,
+            "pattern": pattern,
+            "runs": len(group),
+            "reached": len(generations),
+            "median": float(np.median(generations)) if generations else None,
+            "min": min(generations) if generations else None,
+            "max": max(generations) if generations else None,
+        })
+    return rows
+
+
+def final_limit(run):
+    sizes = perfect_sizes(run)
+    sizes = sizes[sizes >= 0]
+    return int(sizes.min()) if len(sizes) else None
+
+
+def summary_table(runs):
+    rows = []
+    for (ff, pattern), group in group_runs(runs):
+        limits = [x for x in map(final_limit, group) if x is not None]
+        scores = [int(run["best_score"].max()) for run in group
+                  if run["best_score"].max() >= 0]
+        rows.append({
+            "ff": ff,
+            "pattern": pattern,
+            "runs": len(group),
+            "generations": float(np.median([run["generation"].max() for run in group])),
+            "best_score": float(np.median(scores)) if scores else None,
+            "tileset_size": float(np.median(limits)) if limits else None,
+            "smallest": min(limits) if limits else None,
+        })
+    return rows
+
+
+def print_table(rows):
+    if not rows:
+        print("no runs")
+        return
+    names = list(rows[0])
+    cells = [[("-" if row[name] is None else f"{row[name]:g}"
+               if isinstance(row[name], float) else str(row[name]))
+              for name in names] for row in rows]
+    widths = [max(len(name), *(len(row[i]) for row in cells))
+              for i, name in enumerate(names)]
+    print("  ".join(name.ljust(width) for name, width in zip(names, widths)))
+    for row in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+#
+# main
+#
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Collect run logs into a columnar store and query it")
+    parser.add_argument("--store", default="analysis",
+                        help="directory of the columnar store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser(
+        "ingest", help="add new and changed runs to the store")
+    ingest_parser.add_argument("--runs", default="runs")
+    ingest_parser.add_argument("--data", default="data")
+    ingest_parser.add_argument("--notable", default="notable_runs")
+    ingest_parser.add_argument("--patterns", default="patterns")
+
+    reach = commands.add_parser(
+        "reach", help="generations to reach a perfect tileset of at most "
+        "--size tiles, per fitness function and pattern")
+    reach.add_argument("--size", type=int, required=True)
+    summary = commands.add_parser(
+        "summary", help="final scores and tileset sizes per fitness function "
+        "and pattern")
+    for query in (reach, summary):
+        query.add_argument("--ff", default=None)
+        query.add_argument("--pattern", default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "ingest":
+        added, unchanged, removed = ingest(args.store, args.runs, args.data,
+                                           args.notable, args.patterns)
+        print(f"{added} runs ingested, {unchanged} unchanged, {removed} removed")
+    elif args.command == "reach":
+        print_table(reach_table(load_runs(args.store, args.ff, args.pattern),
+                                args.size))
+    else:
+        print_table(summary_table(load_runs(args.store, args.ff, args.pattern)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from main import PATS_Approximator, Organism, Pattern, FITNESS_FUNCTIONS, read_pattern
+from main import assemble_organisms, ff_pattern_match_best
+
+
+#
+# Benchmarks
+#
+# Fixed seeds over the bundled patterns and synthetic 8x8, 16x16 and 32x32
+# patterns. Every case times assembly, the fitness functions and mutation on
+# their own, then whole generations of a PATS run. Results are written as
+# JSON and compared against a stored baseline, slower operations are flagged.
+#
+BENCH_SEED = 1234
+
+# name, pattern file or synthetic size, population size, generations
+BENCH_CASES = (
+    ("checkerboard_4", "patterns/checkerboard_4.txt", 200, 20),
+    ("lines_4", "patterns/lines_4.txt", 200, 20),
+    ("random_4", "patterns/random_4.txt", 200, 20),
+    ("random_5", "patterns/random_5.txt", 200, 20),
+    ("synthetic_8", 8, 100, 10),
+    ("synthetic_16", 16, 20, 3),
+    ("synthetic_32", 32, 10, 2),
+)
+
+
+def synthetic_pattern(size, seed=BENCH_SEED):
+    rng = random.Random(seed + size)
+    return [rng.choice(["b", "w"]) for _ in range(size ** 2)]
+
+
+# Median seconds per call over repeat rounds of number calls
+def time_op(fn, repeat, number=1):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    return statistics.median(timings)
+
+
+def bench_operations(pattern, repeat):
+    random.seed(BENCH_SEED)
+    pattern = Pattern(pattern)
+    organisms = [Organism(pattern, 0.25, 0.30) for _ in range(8)]
+    organism = organisms[0]
+    results = {}
+
+    results["assemble"] = time_op(
+        lambda: assemble_organisms([organism]), repeat)
+    results["assemble_batch_per_organism"] = time_op(
+        lambda: assemble_organisms(organisms), repeat) / len(organisms)
+
+    for name in FITNESS_FUNCTIONS:
+        def fitness():
+            organism.fitness_cache.clear()
+            getattr(organism, name)()
+        results[name] = time_op(fitness, repeat)
+
+    results["mutate"] = time_op(organism.mutate, repeat)
+    return results
+
+
+# Runs generations of a PATS run in a scratch directory, returns the seconds
+# per generation and the peak traced memory when trace_memory is set
+def run_pats(pattern, population_size, generations, trace_memory=False):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            pats = PATS_Approximator(pattern, population_size,
+                                     ff_pattern_match_best,
+                                     random_seed=BENCH_SEED, run_id="bench")
+            start = time.perf_counter()
+            for _ in range(generations):
+                pats.run_generation()
+            seconds = (time.perf_counter() - start) / generations
+            pats.close()
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            os.chdir(cwd)
+    return seconds, peak
+
+
+# Timings run without tracemalloc, it slows allocations down; peak memory
+# comes from a separate traced run
+def bench_run(pattern, population_size, generations):
+    seconds, _ = run_pats(pattern, population_size, generations)
+    _, peak = run_pats(pattern, population_size, 1, trace_memory=True)
+    return {
+        "run_generation": seconds,
+        "generations_per_second": 1 / seconds,
+        "organisms_per_second": population_size / seconds,
+        "peak_memory_bytes": peak,
+    }
+
+
+def run_benchmarks(cases, repeat):
+    results = {}
+    for name, source, population_size, generations in cases:
+        if isinstance(source, int):
+            pattern = synthetic_pattern(source)
+        else:
+            pattern = read_pattern(source)
+        print(f"{name}: {len(pattern)} cells, population {population_size}, "
+              f"{generations} generations", file=sys.stderr)
+        results[name] = bench_operations(pattern, repeat)
+        results[name].update(bench_run(pattern, population_size, generations))
+    return results
+
+
+# Metrics where more is better, everything else is a time or a size
+HIGHER_IS_BETTER = ("generations_per_second", "organisms_per_second")
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for case, metrics in results.items():
+        for metric, value in metrics.items():
+            reference = baseline.get(case, {}).get(metric)
+            if not reference:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                change = reference / value - 1
+            else:
+                change = value / reference - 1
+            if change > tolerance:
+                regressions.append((case, metric, reference, value, change))
+    return regressions
+
+
+#
+# main
+#
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Benchmark assembly, fitness, mutation and generations")
+    parser.add_argument("--cases", nargs="+",
+                        choices=[case[0] for case in BENCH_CASES],
+                        help="cases to run, all by default")
+    parser.add_argument("--repeat", type=int, default=7,
+                        help="rounds per operation, the median is reported")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="results to compare against")
+    parser.add_argument("--save-baseline",
+                        help="also write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown before flagging, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in BENCH_CASES
+             if args.cases is None or case[0] in args.cases]
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": run_benchmarks(cases, args.repeat),
+    }
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    for case, metrics in report["results"].items():
+        print(f"--- {case} ---")
+        for metric, value in metrics.items():
+            print(f"{metric:>36}: {value:.6g}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(report["results"], baseline, args.tolerance)
+        for case, metric, reference, value, change in regressions:
+            print(f"REGRESSION {case} {metric}: {reference:.6g} -> "
+                  f"{value:.6g} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
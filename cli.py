@@ -0,0 +1,213 @@
+import argparse
+import json
+import sys
+
+
+#
+# Command line
+#
+# One entry point for every way of running PATS:
+#
+#   python3 cli.py run --config run.json --generations 500
+#   python3 cli.py resume runs/<ID>/checkpoint.bin --generations 500
+#   python3 cli.py render runs/<ID>/population_00500.npz
+#   python3 cli.py export runs/<ID>/checkpoint.bin --store solutions
+#   python3 cli.py solutions --store solutions
+#   python3 cli.py sweep|islands|bench|analyze [their own arguments]
+#
+# NumPy and the PATS modules are only imported by the subcommand that runs,
+# so the help and argument errors come back at once.
+#
+DELEGATED = {
+    "sweep": "run a grid of PATS experiments in parallel",
+    "islands": "run PATS as an island model with migration",
+    "bench": "benchmark assembly, fitness, mutation and generations",
+    "analyze": "collect run logs into a columnar store and query it",
+}
+
+# Config keys that are not PATS_Approximator arguments
+RUN_KEYS = ("pattern", "generations", "population_size", "ff", "data_every",
+            "print_every", "snapshot_every", "stopping")
+
+DEFAULT_CONFIG = {
+    "generations": 2_000,
+    "population_size": 200,
+    "ff": "ff_pattern_match_first",
+    "data_every": 10,
+    "print_every": 100,
+    "snapshot_every": 0,
+}
+
+
+def load_config(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def run_config(args):
+    config = dict(DEFAULT_CONFIG)
+    if args.config:
+        config.update(load_config(args.config))
+    for key in ("pattern", "generations", "population_size", "ff", "workers",
+                "mutation", "mutation_rate", "seed_mutation_rate",
+                "schedule", "rng_mode", "random_seed", "output",
+                "data_every", "print_every", "snapshot_every",
+                "checkpoint_every"):
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+    if "pattern" not in config:
+        raise SystemExit("error: no pattern, give --pattern or set it in the config")
+    return config
+
+
+def command_run(args):
+    config = run_config(args)
+
+    import main
+    if config["ff"] not in main.FITNESS_FUNCTIONS:
+        raise SystemExit(f"error: unknown fitness function: {config['ff']}")
+    stopping = None
+    if config.get("stopping"):
+        stopping = main.StoppingCriteria(**config["stopping"])
+    options = {key: value for key, value in config.items()
+               if key not in RUN_KEYS}
+
+    pats = main.PATS_Approximator(main.read_pattern(config["pattern"]),
+                                  config["population_size"],
+                                  main.FITNESS_FUNCTIONS[config["ff"]],
+                                  stopping=stopping, **options)
+    print(f"ID: {pats.id}")
+    finish(pats, config["generations"], config["data_every"],
+           config["print_every"], config["snapshot_every"])
+
+
+def command_resume(args):
+    import main
+    pats = main.PATS_Approximator.resume(args.checkpoint, workers=args.workers)
+    print(f"ID: {pats.id}, resuming at generation {pats.generation}")
+    finish(pats, args.generations, args.data_every, args.print_every,
+           args.snapshot_every)
+
+
+def finish(pats, generations, data_every, print_every, snapshot_every):
+    try:
+        reason = pats.run(generations, data_every, print_every, snapshot_every)
+        print(f"Stopped at generation {pats.generation}: {reason}")
+        print(f"Best score: {pats.best_score}, "
+              f"tileset size limit: {pats.tileset_size_limit}")
+    finally:
+        pats.close()
+
+
+def command_render(args):
+    import main
+    text = main.render_snapshot(args.snapshot)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+# Every perfect organism of a snapshot or checkpoint into the solution store
+def command_export(args):
+    import main
+    store = main.SolutionStore(args.store)
+    generation, population = main.load_snapshot(args.snapshot)
+    added = duplicates = 0
+    for o in population:
+        if o.incorrect != 0:
+            continue
+        if store.add(main.Tileset.from_organism(o), {
+                "snapshot": args.snapshot, "generation": generation,
+                "score": o.score}):
+            added += 1
+        else:
+            duplicates += 1
+    print(f"{added} new tilesets, {duplicates} already stored")
+
+
+def command_solutions(args):
+    import main
+    store = main.SolutionStore(args.store)
+    records = sorted((store.get(key) for key in store.keys()),
+                     key=lambda record: record["tileset_size"])
+    for record in records:
+        print(f"{record['key'][:16]} {record['tileset']['pattern_size']}x"
+              f"{record['tileset']['pattern_size']} "
+              f"{record['tileset_size']:>4} tiles, "
+              f"found {len(record['sources'])} times")
+
+
+def parser():
+    result = argparse.ArgumentParser(description="Pattern self-assembly "
+                                     "tile set synthesis with a genetic algorithm")
+    commands = result.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="start a run")
+    run.add_argument("--config", help="JSON file of run settings, the "
+                     "options below override it")
+    run.add_argument("--pattern", help="pattern file")
+    run.add_argument("--generations", type=int)
+    run.add_argument("--population-size", type=int)
+    run.add_argument("--ff", help="fitness function name")
+    run.add_argument("--workers", type=int)
+    run.add_argument("--mutation", help="uniform, sparse or focused")
+    run.add_argument("--mutation-rate", type=float)
+    run.add_argument("--seed-mutation-rate", type=float)
+    run.add_argument("--schedule", help="constant, one_fifth, self_adaptive, "
+                     "linear or exponential")
+    run.add_argument("--random-seed", type=int)
+    run.add_argument("--rng-mode", help="global or streams")
+    run.add_argument("--output", help="full, summary or none")
+    run.add_argument("--data-every", type=int)
+    run.add_argument("--print-every", type=int)
+    run.add_argument("--snapshot-every", type=int,
+                     help="write runs/<ID>/population_<GENERATION>.npz")
+    run.add_argument("--checkpoint-every", type=int)
+    run.set_defaults(handler=command_run)
+
+    resume = commands.add_parser("resume", help="continue from a checkpoint")
+    resume.add_argument("checkpoint")
+    resume.add_argument("--generations", type=int, default=2_000)
+    resume.add_argument("--workers", type=int, default=1)
+    resume.add_argument("--data-every", type=int, default=10)
+    resume.add_argument("--print-every", type=int, default=100)
+    resume.add_argument("--snapshot-every", type=int, default=0)
+    resume.set_defaults(handler=command_resume)
+
+    render = commands.add_parser(
+        "render", help="print the population of a snapshot or checkpoint as text")
+    render.add_argument("snapshot")
+    render.add_argument("-o", "--output", help="write to this file instead")
+    render.set_defaults(handler=command_render)
+
+    export = commands.add_parser(
+        "export", help="add the perfect tilesets of a snapshot or checkpoint "
+        "to the solution store")
+    export.add_argument("snapshot")
+    export.add_argument("--store", default="solutions")
+    export.set_defaults(handler=command_export)
+
+    solutions = commands.add_parser("solutions",
+                                    help="list the solution store")
+    solutions.add_argument("--store", default="solutions")
+    solutions.set_defaults(handler=command_solutions)
+
+    for name, description in DELEGATED.items():
+        commands.add_parser(name, help=description, add_help=False)
+    return result
+
+
+#
+# main
+#
+if __name__ == "__main__":
+    # sweep, islands, bench and analyze keep their own arguments
+    if len(sys.argv) > 1 and sys.argv[1] in DELEGATED:
+        module = __import__(sys.argv[1])
+        module.main(sys.argv[2:], prog=f"{sys.argv[0]} {sys.argv[1]}")
+    else:
+        args = parser().parse_args()
+        args.handler(args)
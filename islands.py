@@ -0,0 +1,188 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from main import PATS_Approximator, StoppingCriteria, FITNESS_FUNCTIONS, read_pattern
+from main import new_run_id
+
+
+#
+# Island model
+#
+# Several PATS populations evolve side by side, one process each, with their
+# own fitness function, mutation rate and seed. Every migration interval the
+# islands pause, the best organisms of each island travel as compact genomes
+# to the next island of the ring, and evolution continues. An island whose
+# stopping criteria are met stops evolving but still sends its best on; the
+# model ends when every island has stopped or the generations run out.
+#
+SUMMARY_COLUMNS = ("run_id", "island", "ff", "mutation_rate", "seed",
+                   "generations", "best_score", "tileset_size_limit",
+                   "incorrect", "tileset_size", "first_perfect_generation",
+                   "stop_reason", "evaluations")
+
+
+def island_status(pats, island):
+    best = pats.population[0]
+    return {
+        "run_id": pats.id,
+        "island": island,
+        "ff": pats.ff.__name__,
+        "mutation_rate": pats.mutation_rate,
+        "seed": pats.random_seed,
+        "generations": pats.generation,
+        "best_score": pats.best_score,
+        "tileset_size_limit": pats.tileset_size_limit,
+        "incorrect": best.incorrect,
+        "tileset_size": best.tileset_size,
+        "first_perfect_generation": pats.first_perfect_generation,
+        "stop_reason": pats.stop_reason,
+        "evaluations": pats.evaluations,
+    }
+
+
+# Island process: answers ("epoch", generations, genomes) with its emigrants
+# and status after taking in the genomes and evolving, and ("close",) with
+# its final status
+def run_island(conn, island, run_id, pattern, population_size, ff_name,
+               mutation_rate, seed, migrants, data_every, stopping,
+               solutions=None):
+    pats = PATS_Approximator(pattern, population_size,
+                             FITNESS_FUNCTIONS[ff_name],
+                             mutation_rate=mutation_rate, random_seed=seed,
+                             run_id=run_id, stopping=stopping,
+                             solutions=solutions)
+    while True:
+        message = conn.recv()
+        if message[0] == "close":
+            if pats.stop_reason is None:
+                pats.write_stop("generations")
+            pats.close()
+            conn.send(island_status(pats, island))
+            conn.close()
+            return
+
+        _, generations, genomes = message
+        if pats.stop_reason is None:
+            pats.immigrate(genomes)
+            for _ in range(generations):
+                pats.run_generation()
+                if data_every and (pats.generation - 1) % data_every == 0:
+                    pats.write_data()
+                if pats.should_stop():
+                    break
+        conn.send((pats.emigrants(migrants), island_status(pats, island)))
+
+
+def run_islands(pattern_file, islands, ff_names, mutation_rates,
+                population_size, generations, migration_interval, migrants,
+                seed=0, data_every=10, stopping=None, directory="islands",
+                solutions=None):
+    model_id = new_run_id()
+    pattern = read_pattern(pattern_file)
+    print(f"Island model {model_id}: {islands} islands")
+
+    # fitness functions and mutation rates are cycled over the islands
+    connections = []
+    processes = []
+    for i in range(islands):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_island, args=(
+            child_conn, i, f"{model_id}-{i:02}", pattern, population_size,
+            ff_names[i % len(ff_names)],
+            mutation_rates[i % len(mutation_rates)], seed + i, migrants,
+            data_every, stopping, solutions))
+        process.start()
+        connections.append(conn)
+        processes.append(process)
+
+    start = time.perf_counter()
+    arrivals = [[] for _ in range(islands)]
+    done = 0
+    while done < generations:
+        epoch = min(migration_interval, generations - done)
+        for conn, genomes in zip(connections, arrivals):
+            conn.send(("epoch", epoch, genomes))
+        results = [conn.recv() for conn in connections]
+        done += epoch
+
+        # ring topology, island i receives from island i - 1
+        arrivals = [results[i - 1][0] for i in range(islands)]
+        statuses = [status for _, status in results]
+        best = max(statuses, key=lambda status: status["best_score"])
+        print(f"Generation {done} / {generations} best score "
+              f"{best['best_score']} on island {best['island']}, "
+              f"tileset {min(s['tileset_size_limit'] for s in statuses)}, "
+              f"{time.perf_counter() - start:.1f} s")
+        if all(status["stop_reason"] is not None for status in statuses):
+            break
+
+    rows = []
+    for conn in connections:
+        conn.send(("close",))
+        rows.append(conn.recv())
+    for process in processes:
+        process.join()
+
+    path = os.path.join(directory, model_id, "summary.npz")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, **{name: np.array([row[name] for row in rows])
+                      for name in SUMMARY_COLUMNS})
+    return path
+
+
+#
+# main
+#
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Run PATS as an island model with migration")
+    parser.add_argument("--pattern", default="patterns/random_5.txt")
+    parser.add_argument("--islands", type=int, default=os.cpu_count())
+    parser.add_argument("--ff", nargs="+", choices=sorted(FITNESS_FUNCTIONS),
+                        default=["ff_pattern_match_first"],
+                        help="fitness functions, cycled over the islands")
+    parser.add_argument("--mutation-rates", nargs="+", type=float,
+                        default=[0.25],
+                        help="mutation rates, cycled over the islands")
+    parser.add_argument("--population-size", type=int, default=200)
+    parser.add_argument("--generations", type=int, default=2_000)
+    parser.add_argument("--migration-interval", type=int, default=50,
+                        help="generations between migrations")
+    parser.add_argument("--migrants", type=int, default=2,
+                        help="organisms each island sends per migration")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="island i uses seed + i")
+    parser.add_argument("--data-every", type=int, default=10,
+                        help="write_data interval, 0 to disable")
+    parser.add_argument("--target-score", type=int, default=None)
+    parser.add_argument("--target-tileset-size", type=int, default=None)
+    parser.add_argument("--patience", type=int, default=None)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("--max-evaluations", type=int, default=None)
+    parser.add_argument("--solutions", default=None,
+                        help="solution store directory for perfect tilesets")
+    args = parser.parse_args(argv)
+
+    if not 0 <= args.migrants <= args.population_size // 10:
+        parser.error("--migrants can be at most the elite, "
+                     "a tenth of --population-size")
+
+    path = run_islands(args.pattern, args.islands, args.ff,
+                       args.mutation_rates, args.population_size,
+                       args.generations, args.migration_interval,
+                       args.migrants, args.seed, args.data_every,
+                       StoppingCriteria(args.target_score,
+                                        args.target_tileset_size,
+                                        args.patience, args.max_seconds,
+                                        args.max_evaluations),
+                       solutions=args.solutions)
+    print(f"Summary: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,98 @@
 # imports
-import copy
 import random
 import math
+import asyncio
+import concurrent.futures
+import contextlib
 import datetime
+import json
+import functools
+import hashlib
+import heapq
 import os
 import sys
+import atexit
+import collections
+import queue
+import threading
+import time
+import uuid
+
+import numpy as np
+
+
+#
+# Patterns
+#
+# Pattern files hold the colors separated by whitespace, row by row
+#
+def read_pattern(path):
+    with open(path, "r") as f:
+        return f.read().split()
+
+
+# A pattern decoded once and shared by every organism of a run: the cells as
+# read, the sorted color alphabet, and every cell's color as an index into
+# the alphabet in assembly order, row by row up from the seed. Any number of
+# colors works.
+class Pattern:
+    def __init__(self, cells):
+        self.cells = list(cells)
+        self.size = math.isqrt(len(self.cells))
+        if self.size ** 2 != len(self.cells):
+            raise ValueError(f"pattern of {len(self.cells)} cells is not square")
+        grid = np.array(self.cells).reshape(self.size, self.size)
+        self.alphabet, colors = np.unique(grid[::-1].ravel(), return_inverse=True)
+        self.colors = colors.astype(np.min_scalar_type(len(self.alphabet)))
+
+    def __len__(self):
+        return len(self.cells)
+
+
+#
+# Random helpers
+#
+# numpy generators are seeded from the global random stream, so the run stays
+# reproducible from random_seed alone. Runs logged before glue tables were
+# drawn this way used per-entry random.randint calls, and do not reproduce
+# from the seed in their _info.txt.
+#
+def numpy_rng():
+    return np.random.default_rng(random.getrandbits(64))
+
+
+# Independent stream for the organism at index of a generation, so it depends
+# only on random_seed and its place in the run, not on what was drawn before
+def stream_rng(random_seed, generation, index):
+    return np.random.default_rng(
+        np.random.SeedSequence((random_seed, generation, index)))
+
+
+# Draws from rng, or from the global stream when there is none
+def random_index(rng, n):
+    return random.randrange(n) if rng is None else int(rng.integers(n))
+
+
+def random_uniform(rng):
+    return random.random() if rng is None else rng.random()
+
+
+def random_gauss(rng):
+    return random.gauss(0, 1) if rng is None else rng.standard_normal()
+
+
+# smallest unsigned integer type that can hold glues [0, max_glues]
+def glue_dtype(max_glues):
+    return np.min_scalar_type(max_glues)
+
+
+# splitmix64 of every (south, west) pair id under a per table key, the
+# default glues of a LazyGlueTable
+def hash_pairs(key, pairs):
+    z = pairs.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64(key)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
 
 
 #
@@ -32,124 +120,1434 @@ def ff_line_match_first(organism):
     return organism.ff_line_match_first()
 
 
+FITNESS_FUNCTIONS = {ff.__name__: ff for ff in (
+    ff_pattern_match_first,
+    ff_pattern_match_best,
+    ff_pattern_match_first_tile_limit,
+    ff_pattern_match_best_tile_limit,
+    ff_line_match_first,
+)}
+
+
+#
+# Fitness cache
+#
+# Each fitness function stores its results on the organism. The cache keeps
+# them per fitness function and restores them while the glue table and the
+# tileset size limit are unchanged. Seed glues only change through mutate,
+# which returns a new organism with an empty cache.
+#
+FITNESS_ATTRIBUTES = ("score", "perfect_score", "incorrect", "tileset_size",
+                      "tile_cells", "tile_colors", "assembly")
+
+
+def cached_fitness(ff):
+    @functools.wraps(ff)
+    def wrapper(self):
+        if self.load_fitness(ff.__name__):
+            return self.score
+        if self.memo is None:
+            ff(self)
+            self.store_fitness(ff.__name__)
+            return self.score
+
+        key = (self.assemble().fingerprint(), ff.__name__,
+               self.tileset_size_limit)
+        values = self.memo.get(key)
+        if values is None:
+            ff(self)
+            self.store_fitness(ff.__name__)
+            self.memo.put(key, self.fitness_cache[ff.__name__][1])
+        else:
+            self.store_fitness(ff.__name__, values)
+            self.load_fitness(ff.__name__)
+        return self.score
+
+    return wrapper
+
+
+#
+# Assembly memo
+#
+# An organism's grid is its seed glues plus the glues it read at every
+# (south, west) pair it consulted, so a hash of the grid fingerprints exactly
+# the entries the assembly depends on. Organisms with the same fingerprint
+# score the same, however much their unread entries differ. The memo maps
+# (fingerprint, fitness function, tileset size limit) to the stored fitness
+# values, dropping the least recently used beyond max_size, and is shared by
+# all organisms of a run.
+#
+class AssemblyMemo:
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        values = self.entries.get(key)
+        if values is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return values
+
+    def put(self, key, values):
+        self.entries[key] = values
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+#
+# Mutation strategies
+#
+# uniform: a coin flip for every glue table entry
+# sparse: same distribution, drawing the number of mutations and then only
+#         those positions
+# focused: sparse, restricted to the entries the organism's assembly reads
+#
+MUTATION_STRATEGIES = ("uniform", "sparse", "focused")
+
+
+#
+# Parallel evaluation
+#
+# Worker processes receive the pattern once when they start. Organisms are
+# shipped as their compact genome bytes, and only the scores and the stats
+# needed by run_generation come back.
+#
+worker_pattern = None
+
+
+def init_worker(pattern):
+    global worker_pattern
+    worker_pattern = pattern
+
+
+def score_genomes(ff_name, glue_table, genomes, tileset_size_limits):
+    organisms = [Organism(worker_pattern, 0, 0, genome=genome,
+                          glue_table=glue_table)
+                 for genome in genomes]
+    assemble_organisms(organisms)
+
+    results = []
+    for organism, limit in zip(organisms, tileset_size_limits):
+        organism.tileset_size_limit = limit
+        getattr(organism, ff_name)()
+        results.append((organism.score, organism.perfect_score,
+                        organism.incorrect, organism.tileset_size))
+    return results
+
+
+# Children planned by new_population: each task is the parent genome, the
+# other parent's genome or None, the child's rates and the state of its
+# random stream after selection
+def breed_genomes(mutation_strategy, glue_table, tasks):
+    results = []
+    for genome, other, rates, state in tasks:
+        rng = np.random.Generator(np.random.PCG64())
+        rng.bit_generator.state = state
+        parent = Organism(worker_pattern, 0, 0, genome=genome,
+                          mutation_strategy=mutation_strategy,
+                          glue_table=glue_table)
+        if other is not None:
+            parent = parent.crossover(
+                Organism(worker_pattern, 0, 0, genome=other,
+                         mutation_strategy=mutation_strategy,
+                         glue_table=glue_table), rng)
+        results.append(parent.mutate(rates, rng).genome())
+    return results
+
+
+#
+# RunLogger
+#
+# Writes go through a queue to a background thread, which keeps appended
+# files open with a large buffer and flushes them whenever the queue runs
+# dry. Errors in the thread are raised again on the next call.
+#
+class RunLogger:
+    def __init__(self, buffer_size=1 << 16):
+        self.buffer_size = buffer_size
+        self.bytes_written = 0
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, kind, path, payload):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((kind, path, payload))
+
+    # Append text to a file
+    def write(self, path, text):
+        self.put("append", path, text)
+
+    # Replace a whole file
+    def write_file(self, path, text):
+        self.put("file", path, text)
+
+    # Save arrays as .npz
+    def save_arrays(self, path, arrays):
+        self.put("arrays", path, arrays)
+
+    # Write a checkpoint, see write_checkpoint
+    def save_checkpoint(self, path, header, arrays):
+        self.put("checkpoint", path, (header, arrays))
+
+    # Wait until everything queued so far is on disk
+    def flush(self):
+        self.queue.put(("flush", None, None))
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        atexit.unregister(self.close)
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        files = {}
+        try:
+            while True:
+                message = self.queue.get()
+                try:
+                    if message is None:
+                        return
+                    kind, path, payload = message
+                    if path is not None:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                    if kind == "append":
+                        if path not in files:
+                            files[path] = open(path, "a", buffering=self.buffer_size)
+                        files[path].write(payload)
+                        self.bytes_written += len(payload)
+                    elif kind == "file":
+                        with open(path, "w") as f:
+                            f.write(payload)
+                        self.bytes_written += len(payload)
+                    elif kind == "arrays":
+                        np.savez(path, **payload)
+                        self.bytes_written += os.path.getsize(path)
+                    elif kind == "checkpoint":
+                        write_checkpoint(path, *payload)
+                        self.bytes_written += os.path.getsize(path)
+                    if self.queue.empty():
+                        for f in files.values():
+                            f.flush()
+                finally:
+                    self.queue.task_done()
+        except Exception as e:
+            self.error = e
+            # keep draining, so flush and close do not block
+            while True:
+                message = self.queue.get()
+                self.queue.task_done()
+                if message is None:
+                    return
+        finally:
+            for f in files.values():
+                f.close()
+
+
+#
+# RunStats
+#
+# Wall time and call counts per phase of run_generation, cumulative and for
+# the last generation, plus counters of organisms assembled, fitness cache
+# hits and bytes handed to the run logger. NullStats stands in when the
+# instrumentation is off, so every timed block costs one method call.
+#
+RUN_PHASES = ("score", "tileset_limit", "write", "new_population")
+
+
+class PhaseTimer:
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.phase, time.perf_counter() - self.start)
+
+
+class RunStats:
+    def __init__(self, logger, memo=None):
+        self.logger = logger
+        self.memo = memo
+        self.generations = 0
+        self.seconds = dict.fromkeys(RUN_PHASES, 0.0)
+        self.calls = dict.fromkeys(RUN_PHASES, 0)
+        self.last_seconds = dict.fromkeys(RUN_PHASES, 0.0)
+        self.assemblies = 0
+        self.cache_hits = 0
+        self.header_written = False
+
+    @property
+    def bytes_written(self):
+        return self.logger.bytes_written
+
+    def start_generation(self):
+        self.generations += 1
+        self.last_seconds = dict.fromkeys(RUN_PHASES, 0.0)
+
+    def phase(self, phase):
+        return PhaseTimer(self, phase)
+
+    def add_time(self, phase, seconds):
+        self.seconds[phase] += seconds
+        self.calls[phase] += 1
+        self.last_seconds[phase] += seconds
+
+    def count_scoring(self, assemblies, cache_hits):
+        self.assemblies += assemblies
+        self.cache_hits += cache_hits
+
+    def csv_header(self):
+        return ",".join(("generation",) + RUN_PHASES +
+                        ("assemblies", "cache_hits", "memo_hits",
+                         "memo_misses", "bytes_written")) + "\n"
+
+    # Last generation's phase times with the cumulative counters
+    def csv_row(self, generation):
+        values = [str(generation)]
+        values += [f"{self.last_seconds[phase]:.6f}" for phase in RUN_PHASES]
+        memo = self.memo or AssemblyMemo()
+        values += [str(self.assemblies), str(self.cache_hits),
+                   str(memo.hits), str(memo.misses), str(self.bytes_written)]
+        return ",".join(values) + "\n"
+
+    def __str__(self):
+        res = f"Generations: {self.generations}\n"
+        for phase in RUN_PHASES:
+            res += f"{phase:>15}: {self.seconds[phase]:.3f} s " + \
+                f"in {self.calls[phase]} calls\n"
+        res += f"Assemblies: {self.assemblies}\n"
+        res += f"Cache hits: {self.cache_hits}\n"
+        if self.memo is not None:
+            res += f"Memo hits: {self.memo.hits} " + \
+                f"({self.memo.hit_rate:.1%} of lookups)\n"
+        res += f"Bytes written: {self.bytes_written}\n"
+        return res
+
+
+class NullStats:
+    null_phase = contextlib.nullcontext()
+
+    def start_generation(self):
+        pass
+
+    def phase(self, phase):
+        return self.null_phase
+
+    def count_scoring(self, assemblies, cache_hits):
+        pass
+
+
+#
+# Checkpoints
+#
+# A checkpoint file is the magic bytes, the format version and the length of
+# a JSON header, then the header, then the raw arrays. The header holds the
+# run state and the dtype, shape and offset of every array. Arrays start on
+# 64 byte boundaries, so they can be memory mapped in place. Files are written
+# next to their final path and renamed over it, so a checkpoint is either the
+# old one or the new one, never half written.
+#
+CHECKPOINT_MAGIC = b"PATSCKPT"
+CHECKPOINT_VERSION = 1
+CHECKPOINT_ALIGNMENT = 64
+
+
+def align(offset):
+    return -(-offset // CHECKPOINT_ALIGNMENT) * CHECKPOINT_ALIGNMENT
+
+
+def write_checkpoint(path, header, arrays):
+    header = dict(header, arrays={})
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = align(offset + array.nbytes)
+    encoded = json.dumps(header).encode()
+    start = align(len(CHECKPOINT_MAGIC) + 8 + len(encoded))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(CHECKPOINT_MAGIC)
+        f.write(CHECKPOINT_VERSION.to_bytes(4, "little"))
+        f.write(len(encoded).to_bytes(4, "little"))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.seek(start + header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+# Returns the header and the arrays, memory mapped read only
+def read_checkpoint(path):
+    with open(path, "rb") as f:
+        if f.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            raise ValueError(f"not a checkpoint: {path}")
+        version = int.from_bytes(f.read(4), "little")
+        if version != CHECKPOINT_VERSION:
+            raise ValueError(f"unsupported checkpoint version {version}: {path}")
+        length = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(length))
+    start = align(len(CHECKPOINT_MAGIC) + 8 + length)
+
+    arrays = {}
+    for name, entry in header.pop("arrays").items():
+        shape = tuple(entry["shape"])
+        if 0 in shape:
+            arrays[name] = np.zeros(shape, dtype=entry["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=entry["dtype"], mode="r",
+                                     offset=start + entry["offset"], shape=shape)
+    return header, arrays
+
+
+# Text dump of a scored population, best organism first
+def population_text(generation, population):
+    result = f"*** Generation {generation} ***\n\n"
+    result += "--- Best Organism ---\n"
+    result += str(population[0])
+    for i in range(1, len(population)):
+        result += f"\n--- Population {i:03} ---\n"
+        result += str(population[i])
+        result += "\n"
+    return result
+
+
+# Genome bytes of every organism in checkpoint or snapshot arrays: stacked
+# dense glue tables and seed glues, or the concatenated genomes of lazy tables
+def stored_genomes(arrays):
+    if "genomes" in arrays:
+        ends = np.cumsum(arrays["genome_lengths"])
+        data = np.asarray(arrays["genomes"]).tobytes()
+        return [data[end - length:end]
+                for end, length in zip(ends, arrays["genome_lengths"])]
+    return [glues.tobytes() + seeds.tobytes()
+            for glues, seeds in zip(arrays["glues"], arrays["seeds"])]
+
+
+# Render a population snapshot written by PATS_Approximator.write_snapshot,
+# or the population of a checkpoint, as the text of write_population
+def render_snapshot(path):
+    generation, population = load_snapshot(path)
+    return population_text(generation, population)
+
+
+# Generation and scored population of a snapshot or a checkpoint, best
+# organism first
+def load_snapshot(path):
+    with open(path, "rb") as f:
+        checkpoint = f.read(len(CHECKPOINT_MAGIC)) == CHECKPOINT_MAGIC
+    if checkpoint:
+        header, arrays = read_checkpoint(path)
+    else:
+        arrays = np.load(path)
+        header = {name: arrays[name].tolist() for name in (
+            "pattern", "ff", "generation", "mutation_rate", "seed_mutation_rate",
+            "glue_table")}
+    pattern = Pattern(header["pattern"])
+    ff = FITNESS_FUNCTIONS[header["ff"]]
+    population = []
+    for genome, limit in zip(stored_genomes(arrays),
+                             arrays["tileset_size_limits"]):
+        o = Organism(pattern, float(header["mutation_rate"]),
+                     float(header["seed_mutation_rate"]), genome=genome,
+                     glue_table=header["glue_table"])
+        o.tileset_size_limit = int(limit)
+        ff(o)
+        population.append(o)
+    population.sort(key=ff, reverse=True)
+    return int(header["generation"]), population
+
+
+#
+# Tilesets
+#
+# The tile set an organism actually places, in a canonical form: tiles in the
+# order they first appear in the assembly, each as its (north, east, south,
+# west) glues and color, and glues relabeled 1, 2, ... in the order they are
+# first used, seed glues first. Organisms that only differ in the names of
+# their glues or in table entries the assembly never reads give the same
+# tileset and the same key.
+#
+class Tileset:
+    def __init__(self, pattern_size, seeds, tiles, colors):
+        self.pattern_size = pattern_size
+        self.seeds = seeds
+        self.tiles = tiles
+        self.colors = colors
+
+    @classmethod
+    def from_organism(cls, organism):
+        organism.complete_fitness()
+        assembly = organism.assemble()
+        r, c = np.divmod(organism.tile_cells, organism.pattern_size)
+        r += 1
+        c += 1
+        tiles = np.stack([assembly.north[r, c], assembly.east[r, c],
+                          assembly.north[r - 1, c], assembly.east[r, c - 1]],
+                         axis=1)
+        seeds = assembly.seed_tiles()
+
+        # glues in order of first use, seeds, then every tile's south and
+        # west glues before its north and east ones
+        uses = np.concatenate((seeds, tiles[:, [2, 3, 0, 1]].ravel()))
+        glues, first = np.unique(uses, return_index=True)
+        labels = np.empty(len(glues), dtype=np.int64)
+        labels[np.argsort(first)] = np.arange(1, len(glues) + 1)
+        relabel = labels[np.searchsorted(glues, uses)]
+        return cls(organism.pattern_size, relabel[:len(seeds)].tolist(),
+                   relabel[len(seeds):].reshape(-1, 4)[:, [2, 3, 0, 1]].tolist(),
+                   [str(color) for color in organism.tile_colors])
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def as_dict(self):
+        return {
+            "pattern_size": self.pattern_size,
+            "seeds": self.seeds,
+            "tiles": self.tiles,
+            "colors": self.colors,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["pattern_size"], data["seeds"], data["tiles"],
+                   data["colors"])
+
+    # SHA-256 of the canonical form
+    def key(self):
+        encoded = json.dumps(self.as_dict(), separators=(",", ":"))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+# Solutions are kept one JSON file per distinct tileset, named by its key,
+# with every run and generation that found it. Adding a tileset already in
+# the store only records the new source. Sweeps and islands share one store
+# between processes, so adding holds an exclusive lock on the store's .lock
+# file and decides from the files on disk, not from what this process saw.
+class SolutionStore:
+    def __init__(self, directory="solutions"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def keys(self):
+        return sorted(name[:-len(".json")] for name in os.listdir(self.directory)
+                      if name.endswith(".json"))
+
+    def get(self, key):
+        with open(self.path(key), "r") as f:
+            return json.load(f)
+
+    # Returns whether the tileset was new
+    def add(self, tileset, source):
+        # POSIX only, imported here so the rest of the module works anywhere
+        import fcntl
+        key = tileset.key()
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            new = key not in self
+            if new:
+                record = {"key": key, "tileset_size": len(tileset),
+                          "tileset": tileset.as_dict(), "sources": []}
+            else:
+                record = self.get(key)
+            record["sources"].append(source)
+
+            temporary = self.path(key) + f".{os.getpid()}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(record, f)
+            os.replace(temporary, self.path(key))
+        return new
+
+
+#
+# StoppingCriteria
+#
+# Ends a run before its generation budget. Criteria left at None are off and
+# check returns the name of the first one met: best score reaching
+# target_score, a perfect assembly with at most target_tileset_size tiles,
+# no better score or smaller tileset for patience generations, max_seconds
+# spent in run_generation, or max_evaluations fitness evaluations.
+#
+class StoppingCriteria:
+    def __init__(self, target_score=None, target_tileset_size=None,
+                 patience=None, max_seconds=None, max_evaluations=None):
+        self.target_score = target_score
+        self.target_tileset_size = target_tileset_size
+        self.patience = patience
+        self.max_seconds = max_seconds
+        self.max_evaluations = max_evaluations
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def check(self, pats):
+        if self.target_score is not None and pats.best_score >= self.target_score:
+            return "target_score"
+        if self.target_tileset_size is not None and \
+                pats.first_perfect_generation >= 0 and \
+                pats.tileset_size_limit <= self.target_tileset_size:
+            return "target_tileset_size"
+        if self.patience is not None and \
+                pats.generation - pats.last_improvement >= self.patience:
+            return "patience"
+        if self.max_seconds is not None and pats.seconds >= self.max_seconds:
+            return "max_seconds"
+        if self.max_evaluations is not None and \
+                pats.evaluations >= self.max_evaluations:
+            return "max_evaluations"
+        return None
+
+    def __str__(self):
+        return ", ".join(f"{name}={value}" for name, value in vars(self).items()
+                         if value is not None) or "none"
+
+
 #
 # PATSApproximator
 #
+# glue_table picks the glue table of the organisms: "dense" holds every
+# entry, "lazy" hashes the untouched ones, "auto" goes lazy for focused
+# mutation once dense tables would outgrow LAZY_TABLE_BYTES
+#
+GLUE_TABLES = ("auto", "dense", "lazy")
+LAZY_TABLE_BYTES = 4 * 1024 * 1024
+
+# Parents of the next generation come uniformly from the elite (truncation)
+# or win a tournament among tournament_size random organisms
+SELECTION_STRATEGIES = ("truncation", "tournament")
+
+# How the mutation rates move during a run: "constant", "one_fifth" (grow
+# while more than a fifth of the children beat their parent, shrink
+# otherwise), "self_adaptive" (every organism carries its own rates, which
+# its children perturb log-normally before using them), "linear" (down to
+# min_mutation_rate over schedule_generations) or "exponential" (times decay
+# every generation). The seed mutation rate scales along.
+MUTATION_SCHEDULES = ("constant", "one_fifth", "self_adaptive", "linear",
+                      "exponential")
+ONE_FIFTH_STEP = 0.85
+
+# Where the randomness comes from: "global" is the random module seeded once
+# with random_seed, so every draw depends on all the ones before it.
+# "streams" gives every organism of every generation its own stream from
+# (random_seed, generation, index), which lets the worker pool mutate the
+# children and still reproduce the run exactly.
+RNG_MODES = ("global", "streams")
+
+# What a run writes on its own: "full" is _info.txt, generations.csv and the
+# write_data files, "summary" only _info.txt with the stop reason, "none"
+# nothing. Checkpoints, snapshots and population dumps are always written
+# when asked for.
+OUTPUT_MODES = ("full", "summary", "none")
+
+
+# Start time to the second and a random suffix, so runs started in the same
+# second by separate shells still get their own files
+def new_run_id():
+    now = datetime.datetime.now()
+    return now.strftime("%Y-%m-%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
 class PATS_Approximator:
-    def __init__(self, pattern, population_size, ff):
+    def __init__(self, pattern, population_size, ff, workers=1,
+                 mutation="uniform", checkpoint_every=0, mutation_rate=0.25,
+                 seed_mutation_rate=0.30, random_seed=None, run_id=None,
+                 stats=False, stopping=None, glue_table="auto",
+                 selection="truncation", elite_fraction=0.1, tournament_size=3,
+                 crossover_rate=0.0, output="full", solutions=None,
+                 memo_size=4096, schedule="constant", schedule_generations=1000,
+                 decay=0.995, min_mutation_rate=0.001, rng_mode="global"):
         # class variables
-        self.id = datetime.datetime.now()
-        self.id = (
-            str(self.id.date())
-            + "-"
-            + f"{self.id.hour:02}"
-            + f"{self.id.minute:02}"
-            + f"{self.id.second:02}"
-        )
+        self.id = run_id
+        if self.id is None:
+            self.id = new_run_id()
         self.ff = ff
-        self.mutation_rate = 0.25
-        self.seed_mutation_rate = 0.30
-        self.pattern = pattern
-        self.pattern_size = int(math.sqrt(len(pattern)))
+        self.mutation_rate = mutation_rate
+        self.seed_mutation_rate = seed_mutation_rate
+        if schedule not in MUTATION_SCHEDULES:
+            raise ValueError(f"unknown mutation schedule: {schedule}")
+        self.schedule = schedule
+        self.initial_mutation_rate = mutation_rate
+        self.initial_seed_mutation_rate = seed_mutation_rate
+        self.schedule_generations = schedule_generations
+        self.decay = decay
+        self.min_mutation_rate = min_mutation_rate
+        self.rate_factor = 1.0
+        self.success = 0.0
+        if mutation not in MUTATION_STRATEGIES:
+            raise ValueError(f"unknown mutation strategy: {mutation}")
+        self.mutation_strategy = mutation
+        if selection not in SELECTION_STRATEGIES:
+            raise ValueError(f"unknown selection strategy: {selection}")
+        self.selection = selection
+        if rng_mode not in RNG_MODES:
+            raise ValueError(f"unknown rng mode: {rng_mode}")
+        self.rng_mode = rng_mode
+        if output not in OUTPUT_MODES:
+            raise ValueError(f"unknown output mode: {output}")
+        self.output = output
+        self.solutions = None if solutions is None else SolutionStore(solutions)
+        self.memo = AssemblyMemo(memo_size) if memo_size else None
+        self.elite_fraction = elite_fraction
+        self.tournament_size = tournament_size
+        self.crossover_rate = crossover_rate
+        self.pattern = Pattern(pattern)
+        self.pattern_size = self.pattern.size
+        if glue_table not in GLUE_TABLES:
+            raise ValueError(f"unknown glue table: {glue_table}")
+        if glue_table == "auto":
+            max_glues = 2 * self.pattern_size ** 2
+            dense_bytes = (max_glues + 1) ** 2 * 2 * glue_dtype(max_glues).itemsize
+            glue_table = "dense"
+            if mutation == "focused" and dense_bytes > LAZY_TABLE_BYTES:
+                glue_table = "lazy"
+        self.glue_table = glue_table
         self.population_size = population_size
         self.generation = 0
-        self.random_seed = random.randrange(sys.maxsize)
+        self.checkpoint_every = checkpoint_every
+        self.stopping = stopping
+        self.stop_reason = None
+        self.evaluations = 0
+        self.seconds = 0.0
+        self.last_improvement = 0
+        self.first_perfect_generation = -1
+        self.workers = workers
+        self.start_pool()
+        self.random_seed = random_seed
+        if self.random_seed is None:
+            self.random_seed = random.randrange(sys.maxsize)
         random.seed(self.random_seed)
+        self.logger = RunLogger()
+        self.stats = RunStats(self.logger, self.memo) if stats else NullStats()
         self.write_info()
         self.tileset_size_limit = self.pattern_size ** 2 - 1
-        self.population = [Organism(self.pattern, self.mutation_rate, self.seed_mutation_rate)
-                           for _ in range(self.population_size)]
-        self.population.sort(key=self.ff, reverse=True)
+        self.population = [Organism(self.pattern, self.mutation_rate, self.seed_mutation_rate,
+                                    mutation_strategy=self.mutation_strategy,
+                                    glue_table=self.glue_table,
+                                    rng=self.stream(0, i))
+                           for i in range(self.population_size)]
+        for o in self.population:
+            o.memo = self.memo
+        self.score_population()
         self.best_score = self.population[0].score
-        self.write_population()
+        if self.output == "full":
+            self.logger.write(self.generations_path(),
+                              "generation,best_score,tileset_size,incorrect,"
+                              "tileset_size_limit,seconds,mutation_rate,"
+                              "seed_mutation_rate,success_rate\n")
+        self.write_record(0)
+
+    # Continue a run from a checkpoint written by write_checkpoint, exactly
+    # as if it had never stopped
+    @classmethod
+    def resume(cls, path, workers=1, stats=False):
+        header, arrays = read_checkpoint(path)
+        result = cls.__new__(cls)
+        result.id = header["id"]
+        result.ff = FITNESS_FUNCTIONS[header["ff"]]
+        result.mutation_rate = header["mutation_rate"]
+        result.seed_mutation_rate = header["seed_mutation_rate"]
+        result.schedule = header["schedule"]
+        result.initial_mutation_rate = header["initial_mutation_rate"]
+        result.initial_seed_mutation_rate = header["initial_seed_mutation_rate"]
+        result.schedule_generations = header["schedule_generations"]
+        result.decay = header["decay"]
+        result.min_mutation_rate = header["min_mutation_rate"]
+        result.rate_factor = header["rate_factor"]
+        result.success = header["success"]
+        result.mutation_strategy = header["mutation_strategy"]
+        result.selection = header["selection"]
+        result.rng_mode = header["rng_mode"]
+        result.output = header["output"]
+        result.solutions = None
+        if header["solutions"] is not None:
+            result.solutions = SolutionStore(header["solutions"])
+        result.elite_fraction = header["elite_fraction"]
+        result.tournament_size = header["tournament_size"]
+        result.crossover_rate = header["crossover_rate"]
+        result.pattern = Pattern(header["pattern"])
+        result.pattern_size = result.pattern.size
+        result.glue_table = header["glue_table"]
+        result.population_size = header["population_size"]
+        result.generation = header["generation"]
+        result.checkpoint_every = header["checkpoint_every"]
+        result.stopping = None
+        if header["stopping"] is not None:
+            result.stopping = StoppingCriteria(**header["stopping"])
+        result.stop_reason = None
+        result.evaluations = header["evaluations"]
+        result.seconds = header["seconds"]
+        result.last_improvement = header["last_improvement"]
+        result.first_perfect_generation = header["first_perfect_generation"]
+        result.workers = workers
+        result.start_pool()
+        result.random_seed = header["random_seed"]
+        result.logger = RunLogger()
+        result.memo = None
+        if header["memo_size"]:
+            result.memo = AssemblyMemo(header["memo_size"])
+        result.stats = RunStats(result.logger, result.memo) if stats else NullStats()
+        result.tileset_size_limit = header["tileset_size_limit"]
+        result.best_score = header["best_score"]
+
+        result.population = []
+        for genome, limit, mutation_rate, seed_mutation_rate, parent_score in zip(
+                stored_genomes(arrays), arrays["tileset_size_limits"],
+                arrays["mutation_rates"], arrays["seed_mutation_rates"],
+                arrays["parent_scores"]):
+            o = Organism(result.pattern, float(mutation_rate),
+                         float(seed_mutation_rate), genome=genome,
+                         mutation_strategy=result.mutation_strategy,
+                         glue_table=result.glue_table)
+            o.tileset_size_limit = int(limit)
+            if not np.isnan(parent_score):
+                o.parent_score = int(parent_score)
+            o.memo = result.memo
+            result.population.append(o)
+
+        version, state, gauss_next = header["random_state"]
+        random.setstate((version, tuple(state), gauss_next))
+        return result
+
+    def start_pool(self):
+        self.pool = None
+        if self.workers > 1:
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=init_worker, initargs=(self.pattern,))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.logger.close()
+
+    # Score whatever the fitness cache does not hold yet, either in the worker
+    # pool or by assembling all pending organisms in one batch, then move the
+    # elite to the front, best first. Stacking large or lazy glue tables costs
+    # more than it saves, so those are assembled one by one, incrementally
+    # from the parent when possible.
+    def score_population(self):
+        ff_name = self.ff.__name__
+        pending = [o for o in self.population if not o.has_fitness(ff_name)]
+        self.evaluations += len(pending)
+        self.stats.count_scoring(len(pending), len(self.population) - len(pending))
+        if self.pool is not None and pending:
+            chunk_size = -(-len(pending) // self.workers)
+            chunks = [pending[i:i + chunk_size]
+                      for i in range(0, len(pending), chunk_size)]
+            tasks = self.pool.map(
+                score_genomes,
+                [ff_name] * len(chunks),
+                [self.glue_table] * len(chunks),
+                [[o.genome() for o in chunk] for chunk in chunks],
+                [[o.tileset_size_limit for o in chunk] for chunk in chunks])
+            for chunk, results in zip(chunks, tasks):
+                for o, (score, perfect_score, incorrect, tileset_size) in zip(chunk, results):
+                    o.store_fitness(ff_name, {
+                        "score": score,
+                        "perfect_score": perfect_score,
+                        "incorrect": incorrect,
+                        "tileset_size": tileset_size,
+                        "tile_cells": None,
+                        "tile_colors": None,
+                        "assembly": None,
+                    })
+        elif pending and pending[0].gluetable.dense and \
+                pending[0].gluetable.nbytes <= BATCH_TABLE_BYTES:
+            assemble_organisms(pending)
+
+        # same order as a full sort for the elite, the rest is left as is
+        elite = heapq.nlargest(self.elite_size(), self.population, key=self.ff)
+        chosen = set(map(id, elite))
+        self.population = elite + [o for o in self.population
+                                   if id(o) not in chosen]
+
+    def elite_size(self):
+        return max(1, int(self.population_size * self.elite_fraction))
 
     def update_population(self):
         for i in self.population:
             i.tileset_size_limit = self.tileset_size_limit
 
     def new_population(self):
-        # top ten of population
-        top_ten_index = int(len(self.population) * 0.1)
-        top_ten = []
-        for i in range(top_ten_index):
-            top_ten.append(self.population[i])
+        # elite of population
+        elite_size = self.elite_size()
+        elite = self.population[:elite_size]
 
-        # selection and mutate
+        # selection, crossover and mutate
         next_population = []
-        next_population.extend(top_ten)
+        next_population.extend(elite)
+        for o in elite:
+            o.parent_score = None
+        if self.pool is not None and self.rng_mode == "streams":
+            next_population.extend(self.breed([
+                self.plan_child(elite, self.stream(self.generation, i))
+                for i in range(len(elite), self.population_size)]))
+            return next_population
         while len(next_population) < self.population_size:
-            # select random from best
-            random_index = random.randint(0, top_ten_index - 1)
+            parent, other, rates, rng = self.plan_child(
+                elite, self.stream(self.generation, len(next_population)))
+            child = parent
+            if other is not None:
+                child = parent.crossover(other, rng)
             # mutate and add
-            next_population.append(top_ten[random_index].mutate())
+            child = child.mutate(rates, rng)
+            child.parent_score = parent.score
+            next_population.append(child)
 
         return next_population
 
+    # The random stream of one organism, or None to draw from the global one
+    def stream(self, generation, index):
+        if self.rng_mode != "streams":
+            return None
+        return stream_rng(self.random_seed, generation, index)
+
+    # Parent, other parent or None, rates and random stream of one child
+    def plan_child(self, elite, rng):
+        parent = self.select(elite, rng)
+        rates = None
+        if self.schedule == "self_adaptive":
+            rates = (self.clip_rate(parent.mutation_rate * math.exp(
+                        self.tau() * random_gauss(rng))),
+                     self.clip_rate(parent.seed_mutation_rate * math.exp(
+                         self.tau() * random_gauss(rng))))
+        other = None
+        if self.crossover_rate and random_uniform(rng) < self.crossover_rate:
+            other = self.select(elite, rng)
+        return parent, other, rates, rng
+
+    # Mutate the planned children in the worker pool, each continuing its own
+    # random stream, so they come out as they would in this process
+    def breed(self, plans):
+        tasks = [(parent.genome(), None if other is None else other.genome(),
+                  rates or (parent.mutation_rate, parent.seed_mutation_rate),
+                  rng.bit_generator.state)
+                 for parent, other, rates, rng in plans]
+        chunk_size = -(-len(tasks) // self.workers)
+        chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+        genomes = [genome for results in self.pool.map(
+                       breed_genomes,
+                       [self.mutation_strategy] * len(chunks),
+                       [self.glue_table] * len(chunks), chunks)
+                   for genome in results]
+
+        children = []
+        for (parent, _, _, _), (_, _, rates, _), genome in zip(plans, tasks, genomes):
+            child = Organism(self.pattern, rates[0], rates[1], genome=genome,
+                             mutation_strategy=self.mutation_strategy,
+                             glue_table=self.glue_table)
+            child.tileset_size_limit = parent.tileset_size_limit
+            child.memo = self.memo
+            child.parent_score = parent.score
+            children.append(child)
+        return children
+
+    # Learning rate of the self-adaptive schedule
+    def tau(self):
+        return 1 / math.sqrt(2 * self.pattern_size)
+
+    def clip_rate(self, rate):
+        return min(1.0, max(self.min_mutation_rate, rate))
+
+    # Share of the children scored this generation that beat their parent
+    def success_rate(self):
+        children = [o for o in self.population if o.parent_score is not None]
+        if not children:
+            return 0.0
+        return sum(o.score > o.parent_score for o in children) / len(children)
+
+    # Move the run's mutation rates along the schedule and hand them to the
+    # parents of the next generation
+    def adapt_mutation(self):
+        self.success = self.success_rate()
+        if self.schedule in ("constant", "self_adaptive"):
+            return
+        if self.schedule == "one_fifth":
+            if self.success > 0.2:
+                self.rate_factor /= ONE_FIFTH_STEP
+            elif self.success < 0.2:
+                self.rate_factor *= ONE_FIFTH_STEP
+            self.rate_factor = min(max(
+                self.rate_factor, self.min_mutation_rate / max(
+                    self.initial_mutation_rate, self.initial_seed_mutation_rate)),
+                1 / max(self.initial_mutation_rate, self.initial_seed_mutation_rate))
+        elif self.schedule == "linear":
+            self.rate_factor = max(0.0, 1 - self.generation / self.schedule_generations)
+        else:
+            self.rate_factor = self.decay ** self.generation
+        self.mutation_rate = self.clip_rate(self.initial_mutation_rate * self.rate_factor)
+        self.seed_mutation_rate = self.clip_rate(
+            self.initial_seed_mutation_rate * self.rate_factor)
+        for o in self.population:
+            o.mutation_rate = self.mutation_rate
+            o.seed_mutation_rate = self.seed_mutation_rate
+
+    # The run's rates, averaged over the population when organisms carry
+    # their own
+    def mean_rates(self):
+        if self.schedule != "self_adaptive":
+            return self.mutation_rate, self.seed_mutation_rate
+        return (sum(o.mutation_rate for o in self.population) / len(self.population),
+                sum(o.seed_mutation_rate for o in self.population) / len(self.population))
+
+    def select(self, elite, rng=None):
+        if self.selection == "tournament":
+            contestants = [self.population[random_index(rng, len(self.population))]
+                           for _ in range(self.tournament_size)]
+            return max(contestants, key=self.ff)
+        # select random from best
+        return elite[random_index(rng, len(elite))]
+
+    # Island model migration. After run_generation the scored elites lead the
+    # population, so the best organisms leave as compact genomes and arrivals
+    # take the places of the newest, still unscored children.
+    def emigrants(self, count):
+        return [o.genome() for o in self.population[:count]]
+
+    def immigrate(self, genomes):
+        arrivals = []
+        for genome in genomes:
+            o = Organism(self.pattern, self.mutation_rate,
+                         self.seed_mutation_rate, genome=genome,
+                         mutation_strategy=self.mutation_strategy,
+                         glue_table=self.glue_table)
+            o.tileset_size_limit = self.tileset_size_limit
+            o.memo = self.memo
+            arrivals.append(o)
+        if arrivals:
+            self.population[-len(arrivals):] = arrivals
+
     def run_generation(self):
+        start = time.perf_counter()
         self.generation += 1
+        self.stats.start_generation()
 
         # score and sort
-        self.population.sort(key=self.ff, reverse=True)
-        tileset_size = len(self.population[0].tile_color_map)
-        incorrect = self.population[0].incorrect
-        if incorrect == 0 and tileset_size < self.tileset_size_limit:
-            self.tileset_size_limit = tileset_size
-            self.update_population()
+        with self.stats.phase("score"):
+            self.score_population()
+
+        with self.stats.phase("tileset_limit"):
+            tileset_size = self.population[0].tileset_size
+            incorrect = self.population[0].incorrect
+            if incorrect == 0 and tileset_size < self.tileset_size_limit:
+                self.tileset_size_limit = tileset_size
+                self.update_population()
+                self.last_improvement = self.generation
+                self.store_solution(self.population[0])
+            if incorrect == 0 and self.first_perfect_generation < 0:
+                self.first_perfect_generation = self.generation
 
         # update best score
         if self.population[0].score > self.best_score:
             self.best_score = self.population[0].score
-            # write to file
-            self.write_population()
+            self.last_improvement = self.generation
 
         # select and mutate
-        self.population = self.new_population()
+        best = self.population[0]
+        with self.stats.phase("new_population"):
+            self.adapt_mutation()
+            self.population = self.new_population()
+
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        with self.stats.phase("write"):
+            self.write_record(seconds, best)
+            if self.checkpoint_every and self.generation % self.checkpoint_every == 0:
+                self.write_checkpoint()
+
+    # Each smaller perfect tileset goes to the solution store, if there is one
+    def store_solution(self, organism):
+        if self.solutions is None:
+            return
+        self.solutions.add(Tileset.from_organism(organism), {
+            "run_id": self.id,
+            "generation": self.generation,
+            "ff": self.ff.__name__,
+            "score": organism.score,
+        })
+
+    # Check the stopping criteria, recording the reason when one is met
+    def should_stop(self):
+        if self.stopping is None:
+            return False
+        reason = self.stopping.check(self)
+        if reason is not None:
+            self.write_stop(reason)
+        return reason is not None
+
+    # Run up to generations more generations, or until the stopping criteria
+    # end the run, and return why it stopped
+    def run(self, generations, data_every=0, print_every=0, snapshot_every=0):
+        for g in range(generations):
+            self.run_generation()
+            if print_every and g % print_every == 0:
+                print(f"Generation {g + 1} / {generations}")
+            if data_every and g % data_every == 0:
+                self.write_data()
+            if snapshot_every and self.generation % snapshot_every == 0:
+                self.write_snapshot()
+            if self.should_stop():
+                return self.stop_reason
+        self.write_stop("generations")
+        return self.stop_reason
 
     def print_best(self):
         print(f"*** Generation {self.generation} ***")
         print(self.population[0])
 
+    # Written by the logger thread, so a run starts without waiting on disk
     def write_info(self):
+        if self.output == "none":
+            return
         path = os.path.join("runs", str(self.id), "_info.txt")
+        info = f"ID: {self.id}\n"
+        info += f"Random seed: {self.random_seed}\n"
+        info += f"RNG mode: {self.rng_mode}\n"
+        info += f"Population size: {self.population_size}\n"
+        info += f"Mutation rate: {self.mutation_rate}\n"
+        info += f"Seed mutation rate: {self.seed_mutation_rate}\n"
+        info += f"Mutation schedule: {self.schedule}\n"
+        info += f"Schedule generations: {self.schedule_generations}\n"
+        info += f"Decay: {self.decay}\n"
+        info += f"Min mutation rate: {self.min_mutation_rate}\n"
+        info += f"Mutation strategy: {self.mutation_strategy}\n"
+        info += f"Glue table: {self.glue_table}\n"
+        info += f"Selection: {self.selection}\n"
+        info += f"Elite fraction: {self.elite_fraction}\n"
+        info += f"Tournament size: {self.tournament_size}\n"
+        info += f"Crossover rate: {self.crossover_rate}\n"
+        info += f"Checkpoint every: {self.checkpoint_every}\n"
+        info += f"Stopping criteria: {self.stopping}\n"
+        info += f"Fitness function: {self.ff.__name__}\n\n"
+
+        info += f"Pattern:\n"
+        for r in range(self.pattern_size):
+            for c in range(self.pattern_size):
+                info += self.pattern.cells[(r * self.pattern_size) + c] + " "
+            info += "\n"
+        self.logger.write_file(path, info)
+
+    # Appended to the info file, so a finished run says why it ended
+    def write_stop(self, reason):
+        self.stop_reason = reason
+        if self.output == "none":
+            return
+        path = os.path.join("runs", str(self.id), "_info.txt")
+        self.logger.write(path, f"\nStop reason: {reason}\n"
+                                f"Stopped at generation: {self.generation}\n"
+                                f"Evaluations: {self.evaluations}\n"
+                                f"Seconds: {self.seconds:.3f}\n")
 
-        # make dir, write info in file
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            f.write(f"ID: {self.id}\n")
-            f.write(f"Random seed: {self.random_seed}\n")
-            f.write(f"Population size: {self.population_size}\n")
-            f.write(f"Mutation rate: {self.mutation_rate}\n")
-            f.write(f"Seed mutation rate: {self.seed_mutation_rate}\n")
-            f.write(f"Fitness function: {self.ff.__name__}\n\n")
-
-            f.write(f"Pattern:\n")
-            for r in range(self.pattern_size):
-                for c in range(self.pattern_size):
-                    f.write(self.pattern[(r * self.pattern_size) + c] + " ")
-                f.write("\n")
-
+    # With stats on, the phase times and counters go to a _stats.cvs file
+    # next to the data
     def write_data(self):
-        path = os.path.join("data", f"{self.id}_{self.ff.__name__}.cvs")
-
-        # make dir, write in file
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "a") as f:
-            f.write(f"{self.generation},{self.tileset_size_limit}\n")
-
+        if self.output != "full":
+            return
+        with self.stats.phase("write"):
+            path = os.path.join("data", f"{self.id}_{self.ff.__name__}.cvs")
+            self.logger.write(path, f"{self.generation},{self.tileset_size_limit}\n")
+            if isinstance(self.stats, RunStats):
+                path = os.path.join(
+                    "data", f"{self.id}_{self.ff.__name__}_stats.cvs")
+                if not self.stats.header_written:
+                    self.logger.write(path, self.stats.csv_header())
+                    self.stats.header_written = True
+                self.logger.write(path, self.stats.csv_row(self.generation))
+
+    def generations_path(self):
+        return os.path.join("runs", str(self.id), "generations.csv")
+
+    # One line per generation in runs/<id>/generations.csv
+    def write_record(self, seconds, best=None):
+        if self.output != "full":
+            return
+        if best is None:
+            best = self.population[0]
+        mutation_rate, seed_mutation_rate = self.mean_rates()
+        self.logger.write(self.generations_path(),
+                          f"{self.generation},{self.best_score},"
+                          f"{best.tileset_size},{best.incorrect},"
+                          f"{self.tileset_size_limit},{seconds:.6f},"
+                          f"{mutation_rate:.6g},{seed_mutation_rate:.6g},"
+                          f"{self.success:.4f}\n")
+
+    # Full text dump of the population, only written on request. Scores a
+    # sorted copy, so the population order the run continues from is kept.
     def write_population(self):
         path = os.path.join("runs", str(
             self.id), "score_" + f"{self.best_score:03}" + "_population.txt")
+        with self.stats.phase("write"):
+            population = sorted(self.population, key=self.ff, reverse=True)
+            self.logger.write_file(
+                path, population_text(self.generation, population))
+
+    # The population's genomes for checkpoints and snapshots, see
+    # stored_genomes
+    def genome_arrays(self):
+        if self.glue_table == "dense":
+            return {
+                "glues": np.stack([o.gluetable.glues for o in self.population]),
+                "seeds": np.stack([o.seed_tiles for o in self.population]),
+            }
+        genomes = [o.genome() for o in self.population]
+        return {
+            "genomes": np.frombuffer(b"".join(genomes), dtype=np.uint8),
+            "genome_lengths": np.array([len(g) for g in genomes]),
+        }
+
+    def checkpoint_path(self):
+        return os.path.join("runs", str(self.id), "checkpoint.bin")
+
+    # Binary checkpoint of the whole run state, see resume
+    def write_checkpoint(self):
+        self.logger.save_checkpoint(self.checkpoint_path(), {
+            "id": self.id,
+            "ff": self.ff.__name__,
+            "mutation_rate": self.mutation_rate,
+            "seed_mutation_rate": self.seed_mutation_rate,
+            "schedule": self.schedule,
+            "initial_mutation_rate": self.initial_mutation_rate,
+            "initial_seed_mutation_rate": self.initial_seed_mutation_rate,
+            "schedule_generations": self.schedule_generations,
+            "decay": self.decay,
+            "min_mutation_rate": self.min_mutation_rate,
+            "rate_factor": self.rate_factor,
+            "success": self.success,
+            "mutation_strategy": self.mutation_strategy,
+            "glue_table": self.glue_table,
+            "selection": self.selection,
+            "rng_mode": self.rng_mode,
+            "output": self.output,
+            "solutions": None if self.solutions is None else self.solutions.directory,
+            "memo_size": 0 if self.memo is None else self.memo.max_size,
+            "elite_fraction": self.elite_fraction,
+            "tournament_size": self.tournament_size,
+            "crossover_rate": self.crossover_rate,
+            "pattern": self.pattern.cells,
+            "population_size": self.population_size,
+            "generation": self.generation,
+            "checkpoint_every": self.checkpoint_every,
+            "random_seed": self.random_seed,
+            "random_state": random.getstate(),
+            "tileset_size_limit": self.tileset_size_limit,
+            "best_score": self.best_score,
+            "stopping": None if self.stopping is None else self.stopping.as_dict(),
+            "evaluations": self.evaluations,
+            "seconds": self.seconds,
+            "last_improvement": self.last_improvement,
+            "first_perfect_generation": self.first_perfect_generation,
+        }, dict(self.genome_arrays(), tileset_size_limits=np.array(
+            [o.tileset_size_limit for o in self.population]),
+            mutation_rates=np.array([o.mutation_rate for o in self.population]),
+            seed_mutation_rates=np.array(
+                [o.seed_mutation_rate for o in self.population]),
+            # NaN for organisms that are not children, success_rate skips them
+            parent_scores=np.array([np.nan if o.parent_score is None
+                                    else o.parent_score for o in self.population])))
+
+    # Compact population snapshot, render_snapshot turns it back into the
+    # text of write_population
+    def write_snapshot(self):
+        path = os.path.join("runs", str(self.id),
+                            f"population_{self.generation:05}.npz")
+        self.logger.save_arrays(path, {
+            **self.genome_arrays(),
+            "tileset_size_limits": np.array(
+                [o.tileset_size_limit for o in self.population]),
+            "glue_table": np.array(self.glue_table),
+            "pattern": np.array(self.pattern.cells),
+            "ff": np.array(self.ff.__name__),
+            "generation": np.array(self.generation),
+            "mutation_rate": np.array(self.mutation_rate),
+            "seed_mutation_rate": np.array(self.seed_mutation_rate),
+        })
 
-        # make dir, write info in file
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            f.write(f"*** Generation {self.generation} ***\n\n")
-            f.write("--- Best Organism ---\n")
-            f.write(str(self.population[0]))
-            for i in range(1, self.population_size):
-                f.write(f"\n--- Population {i:03} ---\n")
-                f.write(str(self.population[i]))
-                f.write("\n")
+
+#
+# AsyncRun
+#
+# Drives a PATS_Approximator from an event loop. Generations run in an
+# executor, one at a time per run, so the loop stays free to supervise many
+# runs. Runs with rng_mode "global" share the global random stream, so each
+# of their generations swaps in the run's random state under RANDOM_LOCK:
+# they take turns and each one evolves exactly as it would alone. Runs with
+# rng_mode "streams" never draw from it after construction, so their
+# generations skip the lock and run alongside the others. Stats of every
+# generation are published to the iterators handed out by updates.
+#
+RANDOM_LOCK = threading.Lock()
+
+
+class AsyncRun:
+    # Build the run with create, or right after constructing pats, before
+    # anything else draws from the global random stream
+    def __init__(self, pats, executor=None):
+        self.pats = pats
+        self.executor = executor
+        self.random_state = random.getstate()
+        self.subscribers = []
+        self.task = None
+        self.step = None
+        self.done = False
+
+    # Construct the PATS_Approximator in the executor
+    @classmethod
+    async def create(cls, *args, executor=None, **kwargs):
+        def build():
+            with RANDOM_LOCK:
+                pats = PATS_Approximator(*args, **kwargs)
+                return cls(pats, executor)
+
+        return await asyncio.get_running_loop().run_in_executor(executor, build)
+
+    def run_step(self, write_data):
+        if self.pats.rng_mode == "streams":
+            return self.advance(write_data)
+        with RANDOM_LOCK:
+            random.setstate(self.random_state)
+            stats = self.advance(write_data)
+            self.random_state = random.getstate()
+        return stats
+
+    def advance(self, write_data):
+        pats = self.pats
+        start = time.perf_counter()
+        evaluations = pats.evaluations
+        pats.run_generation()
+        if write_data:
+            pats.write_data()
+        seconds = time.perf_counter() - start
+
+        # after a generation the best scored organism leads the population
+        best = pats.population[0]
+        return {
+            "run_id": pats.id,
+            "generation": pats.generation,
+            "best_score": pats.best_score,
+            "tileset_size": best.tileset_size,
+            "incorrect": best.incorrect,
+            "tileset_size_limit": pats.tileset_size_limit,
+            "evaluations": pats.evaluations,
+            "evaluations_per_second": (pats.evaluations - evaluations) / seconds,
+            "mutation_rate": pats.mean_rates()[0],
+            "success_rate": pats.success,
+            "seconds": seconds,
+        }
+
+    # Run one generation and return its stats
+    async def generation(self, write_data=False):
+        loop = asyncio.get_running_loop()
+        self.step = loop.run_in_executor(self.executor, self.run_step, write_data)
+        # a cancelled caller leaves the generation running, see run
+        stats = await asyncio.shield(self.step)
+        self.step = None
+        self.publish(stats)
+        return stats
+
+    # Run up to generations more generations, or until the stopping criteria
+    # end the run, and return why it stopped. Cancelling waits for the
+    # generation in progress and stops with reason "cancelled".
+    async def run(self, generations, data_every=0):
+        try:
+            for g in range(generations):
+                await self.generation(data_every and g % data_every == 0)
+                if self.pats.should_stop():
+                    return self.pats.stop_reason
+            self.pats.write_stop("generations")
+            return self.pats.stop_reason
+        except asyncio.CancelledError:
+            if self.step is not None:
+                stats = await self.step
+                self.step = None
+                self.publish(stats)
+            self.pats.write_stop("cancelled")
+            raise
+        finally:
+            self.finish()
+
+    # run as a task, for cancel and wait
+    def start(self, generations, data_every=0):
+        self.task = asyncio.ensure_future(self.run(generations, data_every))
+        return self.task
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    # The stop reason once the started run ends, "cancelled" if it was
+    async def wait(self):
+        try:
+            return await self.task
+        except asyncio.CancelledError:
+            return self.pats.stop_reason
+
+    # Shuts down the worker pool and flushes the logger in the executor
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.pats.close)
+
+    def publish(self, stats):
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(stats)
+
+    def finish(self):
+        self.done = True
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(None)
+
+    # Stats of every generation from now until the run ends
+    async def updates(self):
+        if self.done:
+            return
+        subscriber = asyncio.Queue()
+        self.subscribers.append(subscriber)
+        try:
+            while True:
+                stats = await subscriber.get()
+                if stats is None:
+                    return
+                yield stats
+        finally:
+            self.subscribers.remove(subscriber)
+
+    def __aiter__(self):
+        return self.updates()
 
 
 #
@@ -197,6 +1595,141 @@ class Tile:
         return result
 
 
+#
+# Batched assembly
+#
+# Assembles a whole population at once from the stacked (P, G, G, 2) glue
+# tables and the stacked (P, 2n) seed glues. A cell only depends on the cells
+# south and west of it, so the grids fill one anti-diagonal r + c at a time,
+# with a single gather per diagonal for every organism.
+#
+def assemble_population(glues, seeds):
+    population_size = seeds.shape[0]
+    pattern_size = seeds.shape[1] // 2
+    size = pattern_size + 1
+    north = np.zeros((population_size, size, size), dtype=glues.dtype)
+    east = np.zeros((population_size, size, size), dtype=glues.dtype)
+
+    # seed glues, same order as Assembly
+    east[:, size - 1:0:-1, 0] = seeds[:, :pattern_size]
+    north[:, 0, 1:] = seeds[:, pattern_size:]
+
+    organisms = np.arange(population_size)[:, np.newaxis]
+    for d in range(2, 2 * pattern_size + 1):
+        r = np.arange(max(1, d - pattern_size), min(pattern_size, d - 1) + 1)
+        c = d - r
+        tiles = glues[organisms, north[:, r - 1, c], east[:, r, c - 1]]
+        north[:, r, c] = tiles[..., 0]
+        east[:, r, c] = tiles[..., 1]
+
+    return north, east
+
+
+# Glue tables up to this size are stacked for batched assembly
+BATCH_TABLE_BYTES = 256 * 1024
+
+
+# One organism through gluetable.lookup, for tables that cannot be stacked
+def assemble_table(gluetable, seeds):
+    pattern_size = len(seeds) // 2
+    size = pattern_size + 1
+    north = np.zeros((size, size), dtype=glue_dtype(gluetable.max_glues))
+    east = np.zeros((size, size), dtype=north.dtype)
+
+    # seed glues, same order as Assembly
+    east[size - 1:0:-1, 0] = seeds[:pattern_size]
+    north[0, 1:] = seeds[pattern_size:]
+
+    for d in range(2, 2 * pattern_size + 1):
+        r = np.arange(max(1, d - pattern_size), min(pattern_size, d - 1) + 1)
+        c = d - r
+        tiles = gluetable.lookup(north[r - 1, c], east[r, c - 1])
+        north[r, c] = tiles[:, 0]
+        east[r, c] = tiles[:, 1]
+
+    return Assembly.from_grids(north, east)
+
+
+def assemble_organisms(organisms):
+    if not organisms[0].gluetable.dense:
+        for o in organisms:
+            o.set_assembly(assemble_table(o.gluetable, o.seed_tiles))
+        return
+    if len(organisms) == 1:
+        glues = organisms[0].gluetable.glues[np.newaxis]
+    else:
+        glues = np.stack([o.gluetable.glues for o in organisms])
+    north, east = assemble_population(
+        glues, np.stack([o.seed_tiles for o in organisms]))
+    for i, o in enumerate(organisms):
+        o.set_assembly(Assembly.from_grids(north[i], east[i]))
+
+
+#
+# Incremental assembly
+#
+# A mutated child differs from its parent in a few glue table entries and
+# seed glues, so it starts from the parent's grid. Only cells that read a
+# changed entry in the parent's grid (changed_cells) or sit next to a changed
+# seed glue can change, and with them everything to their north-east. That
+# region alone is recomputed, one anti-diagonal at a time, and its tile ids
+# repacked. A child whose changes are never read copies the parent's grid.
+#
+def reassemble(parent, gluetable, seeds, changed_cells, changed_seeds):
+    pattern_size = parent.size - 1
+    north = parent.north.copy()
+    east = parent.east.copy()
+    dirty = changed_cells.copy()
+
+    # seed glues, same order as Assembly
+    west_seeds = changed_seeds[changed_seeds < pattern_size]
+    south_seeds = changed_seeds[changed_seeds >= pattern_size]
+    rows = pattern_size - west_seeds
+    cols = south_seeds - pattern_size + 1
+    east[rows, 0] = seeds[west_seeds]
+    north[0, cols] = seeds[south_seeds]
+    dirty[rows - 1, 0] = True
+    dirty[0, cols - 1] = True
+
+    result = Assembly.from_grids(north, east)
+    if parent.ids is not None:
+        result.ids = parent.ids.copy()
+    if not dirty.any():
+        result.key = parent.key
+        return result
+
+    region = np.logical_or.accumulate(
+        np.logical_or.accumulate(dirty, axis=0), axis=1)
+    r, c = np.nonzero(region)
+    r += 1
+    c += 1
+    order = np.argsort(r + c, kind="stable")
+    r = r[order]
+    c = c[order]
+    diagonals = np.flatnonzero(np.diff(r + c)) + 1
+    for rr, cc in zip(np.split(r, diagonals), np.split(c, diagonals)):
+        tiles = gluetable.lookup(north[rr - 1, cc], east[rr, cc - 1])
+        north[rr, cc] = tiles[:, 0]
+        east[rr, cc] = tiles[:, 1]
+
+    # cells north or east of the region are in it, so only its ids change
+    if result.ids is not None:
+        result.ids[r - 1, c - 1] = pack_tiles(
+            north[r, c], east[r, c], north[r - 1, c], east[r, c - 1],
+            gluetable.max_glues + 1)
+    return result
+
+
+# Pack tiles into one integer each from their four glues, base is one more
+# than the largest glue
+def pack_tiles(north, east, south, west, base):
+    north = north.astype(np.int64)
+    east = east.astype(np.int64)
+    south = south.astype(np.int64)
+    west = west.astype(np.int64)
+    return ((north * base + east) * base + south) * base + west
+
+
 #
 # Assembly
 #
@@ -205,40 +1738,76 @@ class Assembly:
         # class variables
         pattern_size = len(seed_tiles) // 2
         self.size = pattern_size + 1
-        self.assembly = [Tile() for _ in range(self.size ** 2)]
+        # Only the north and east glue of every tile is stored, the south and
+        # west glues are the north glue below and the east glue to the left
+        dtype = glue_dtype(2 * pattern_size ** 2)
+        self.north = np.zeros((self.size, self.size), dtype=dtype)
+        self.east = np.zeros((self.size, self.size), dtype=dtype)
 
         # init seed glues
-        seed_tile_index = 0
         # reverse the rows
-        for r in reversed(range(1, self.size)):
-            self.update_at(r, 0, Tile(east=seed_tiles[seed_tile_index]))
-            seed_tile_index += 1
+        self.east[self.size - 1:0:-1, 0] = seed_tiles[:pattern_size]
+        self.north[0, 1:] = seed_tiles[pattern_size:]
+        self.ids = None
+        self.key = None
+
+    @classmethod
+    def from_grids(cls, north, east):
+        result = cls.__new__(cls)
+        result.size = north.shape[0]
+        result.north = north
+        result.east = east
+        result.ids = None
+        result.key = None
+        return result
 
-        for c in range(1, self.size):
-            self.update_at(0, c, Tile(north=seed_tiles[seed_tile_index]))
-            seed_tile_index += 1
+    def seed_tiles(self):
+        return np.concatenate((self.east[self.size - 1:0:-1, 0],
+                               self.north[0, 1:]))
 
     def update_at(self, x, y, t):
-        self.assembly[(x * self.size) + y] = t
+        self.north[x, y] = t.north
+        self.east[x, y] = t.east
+        self.ids = None
+        self.key = None
 
+    # Tile objects are only materialized on request
     def tile_at(self, x, y):
-        return self.assembly[(x * self.size) + y]
+        south = self.north[x - 1, y] if x > 0 else 0
+        west = self.east[x, y - 1] if y > 0 else 0
+        return Tile(int(self.north[x, y]), int(self.east[x, y]),
+                    int(south), int(west))
+
+    def copy(self):
+        return Assembly.from_grids(self.north.copy(), self.east.copy())
+
+    # Hash of the grid, see AssemblyMemo
+    def fingerprint(self):
+        if self.key is None:
+            self.key = hashlib.blake2b(self.north.tobytes() + self.east.tobytes(),
+                                       digest_size=16).digest()
+        return self.key
+
+    # The (south, west) pair every assembled cell reads from the glue table,
+    # as south * (max_glues + 1) + west
+    def pairs(self):
+        base = 2 * (self.size - 1) ** 2 + 1
+        return self.north[:-1, 1:].astype(np.intp) * base + self.east[1:, :-1]
+
+    # Every assembled tile packed into one integer from its four glues
+    def tile_ids(self):
+        if self.ids is None:
+            self.ids = pack_tiles(self.north[1:, 1:], self.east[1:, 1:],
+                                  self.north[:-1, 1:], self.east[1:, :-1],
+                                  2 * (self.size - 1) ** 2 + 1)
+        return self.ids
 
     def assemble(self, gluetable):
-        result = copy.deepcopy(self)
-
-        for r in range(1, result.size):
-            for c in range(1, result.size):
-                south_glue = result.tile_at(r - 1, c).north
-                west_glue = result.tile_at(r, c - 1).east
-
-                north_glue, east_glue = gluetable.glues_at(
-                    south_glue, west_glue)
-
-                t = Tile(north_glue, east_glue, south_glue, west_glue)
-                result.update_at(r, c, t)
-
-        return result
+        if not gluetable.dense:
+            return assemble_table(gluetable, self.seed_tiles())
+        north, east = assemble_population(
+            gluetable.glues[np.newaxis], self.seed_tiles()[np.newaxis])
+        return Assembly.from_grids(north[0], east[0])
 
     def __str__(self):
         result = ""
@@ -282,23 +1851,125 @@ class Assembly:
 # Organism
 #
 class Organism:
-    def __init__(self, pattern, mutation_rate, seed_mutation_rate):
+    def __init__(self, pattern, mutation_rate, seed_mutation_rate, genome=None,
+                 mutation_strategy="uniform", glue_table="dense", rng=None):
         # class variables
         self.mutation_rate = mutation_rate
         self.seed_mutation_rate = seed_mutation_rate
+        self.mutation_strategy = mutation_strategy
+        self.glue_table = glue_table
+        if not isinstance(pattern, Pattern):
+            pattern = Pattern(pattern)
         self.pattern = pattern
-        self.pattern_size = int(math.sqrt(len(pattern)))
+        self.pattern_size = pattern.size
         self.max_tiles = self.pattern_size ** 2
         self.max_glues = self.max_tiles * 2
-        self.gluetable = GlueTable(self.max_glues)
         self.tileset_size_limit = self.max_tiles - 1
+        self.fitness_cache = {}
+        self.memo = None
+        self.assembled = None
+        self.lineage = None
+        self.parent_score = None
+
+        if genome is not None:
+            table_size = len(genome) - self.pattern_size * 2 * \
+                glue_dtype(self.max_glues).itemsize
+            self.gluetable = self.gluetable_class().frombuffer(
+                self.max_glues, genome[:table_size])
+            self.seed_tiles = np.frombuffer(
+                genome[table_size:], dtype=glue_dtype(self.max_glues)).copy()
+            return
+
+        # seed glues, in the order taken by Assembly
+        if rng is not None:
+            self.gluetable = self.gluetable_class()(self.max_glues, rng)
+            self.seed_tiles = rng.integers(
+                1, self.max_glues, size=self.pattern_size * 2,
+                dtype=glue_dtype(self.max_glues), endpoint=True)
+            return
+
+        self.gluetable = self.gluetable_class()(self.max_glues)
+        self.seed_tiles = np.array([random.randint(1, self.max_glues)
+                                    for _ in range(self.pattern_size * 2)],
+                                   dtype=glue_dtype(self.max_glues))
+
+    # Clone the genome: pattern is shared, the glue table and seed glues are
+    # copied as flat buffers, scores are not carried over
+    def copy(self):
+        result = Organism.__new__(Organism)
+        result.mutation_rate = self.mutation_rate
+        result.seed_mutation_rate = self.seed_mutation_rate
+        result.mutation_strategy = self.mutation_strategy
+        result.glue_table = self.glue_table
+        result.pattern = self.pattern
+        result.pattern_size = self.pattern_size
+        result.max_tiles = self.max_tiles
+        result.max_glues = self.max_glues
+        result.gluetable = self.gluetable.copy()
+        result.tileset_size_limit = self.tileset_size_limit
+        result.seed_tiles = self.seed_tiles.copy()
+        result.fitness_cache = {}
+        result.memo = self.memo
+        result.assembled = None
+        result.lineage = None
+        result.parent_score = None
+        return result
 
-        # seed assembly
-        seed_tiles = [random.randint(1, self.max_glues)
-                      for _ in range(self.pattern_size * 2)]
-        self.seed_assembly = Assembly(seed_tiles)
+    def gluetable_class(self):
+        return LazyGlueTable if self.glue_table == "lazy" else GlueTable
+
+    # Compact genome: the glue table followed by the seed glues, as raw bytes
+    def genome(self):
+        return self.gluetable.tobytes() + self.seed_tiles.tobytes()
+
+    # The assembly is kept until the glue table changes; population scoring
+    # fills it in ahead of time with assemble_organisms. A fresh child is
+    # assembled incrementally from its parent's grid.
+    def assemble(self):
+        if self.assembled is None or self.assembled[0] != self.gluetable.version:
+            if self.lineage is not None and self.lineage[0] == self.gluetable.version:
+                _, parent, changed_cells, changed_seeds = self.lineage
+                self.set_assembly(reassemble(parent, self.gluetable,
+                                             self.seed_tiles, changed_cells,
+                                             changed_seeds))
+            else:
+                assemble_organisms([self])
+        return self.assembled[1]
+
+    def set_assembly(self, assembly):
+        self.assembled = (self.gluetable.version, assembly)
+        self.lineage = None
+
+    def fitness_key(self):
+        return (self.gluetable.version, self.tileset_size_limit)
+
+    def has_fitness(self, ff_name):
+        entry = self.fitness_cache.get(ff_name)
+        return entry is not None and entry[0] == self.fitness_key()
+
+    def load_fitness(self, ff_name):
+        if not self.has_fitness(ff_name):
+            return False
+        for name, value in self.fitness_cache[ff_name][1].items():
+            setattr(self, name, value)
+        self.fitness_function = ff_name
+        return True
+
+    def store_fitness(self, ff_name, values=None):
+        if values is None:
+            values = {name: getattr(self, name) for name in FITNESS_ATTRIBUTES}
+        self.fitness_cache[ff_name] = (self.fitness_key(), values)
+        self.fitness_function = ff_name
+
+    # Scores computed in a worker process come without the tile map and the
+    # assembly; rerun the fitness function locally to rebuild them
+    def complete_fitness(self):
+        if self.assembly is None:
+            del self.fitness_cache[self.fitness_function]
+            getattr(self, self.fitness_function)()
 
     def __str__(self):
+        self.complete_fitness()
         res = ""
 
         # score
@@ -307,266 +1978,452 @@ class Organism:
         res += f"Tile set size limit: {self.tileset_size_limit} \n"
 
         # tileset map
-        res += f"Tile set maping ({len(self.tile_color_map)} tiles):\n"
-        for k in self.tile_color_map.keys():
+        tile_color_map = self.tile_color_map
+        res += f"Tile set maping ({len(tile_color_map)} tiles):\n"
+        for k in tile_color_map.keys():
             res += f"({k.north}, {k.east}, {k.south}, {k.west})" + \
-                f": {self.tile_color_map[k]}\n"
+                f": {tile_color_map[k]}\n"
 
         # assembly
         res += str(self.assembly)
 
         return res
 
+    # Assemble and split the assembled cells into distinct tiles. Cells are
+    # in assembly order, row by row up from the seed, and every tile is one
+    # integer packed from its four glues.
+    def count_tiles(self):
+        self.assembly = self.assemble()
+        tiles = self.assembly.tile_ids().ravel()
+        _, first, inverse = np.unique(
+            tiles, return_index=True, return_inverse=True)
+        return self.pattern.alphabet, self.pattern.colors, first, inverse
+
+    # Keep the tile set in the order the tiles first appear, as the cell each
+    # one first appears on and its color
+    def set_tiles(self, alphabet, first, tile_colors):
+        order = np.argsort(first)
+        self.tile_cells = first[order]
+        self.tile_colors = alphabet[tile_colors[order]]
+        self.tileset_size = len(first)
+
+    # Every tile takes the color of the first cell it is placed on, returns
+    # which cells got the wrong color
+    def match_first(self):
+        alphabet, colors, first, inverse = self.count_tiles()
+        tile_colors = colors[first]
+        self.set_tiles(alphabet, first, tile_colors)
+        return tile_colors[inverse] != colors
+
+    # Every tile takes the color of most of the cells it is placed on, ties
+    # go to the first color of the alphabet, returns the incorrect count
+    def match_best(self):
+        alphabet, colors, first, inverse = self.count_tiles()
+        counts = np.bincount(inverse * len(alphabet) + colors,
+                             minlength=len(first) * len(alphabet))
+        counts = counts.reshape(len(first), len(alphabet))
+        self.set_tiles(alphabet, first, counts.argmax(axis=1))
+        return int(colors.size - counts.max(axis=1).sum())
+
+    # Tile set mapping, rebuilt from the tile ids only when asked for
+    @property
+    def tile_color_map(self):
+        result = {}
+        for cell, color in zip(self.tile_cells, self.tile_colors):
+            r, c = divmod(int(cell), self.pattern_size)
+            result[self.assembly.tile_at(r + 1, c + 1)] = str(color)
+        return result
+
     # Perfect score: every line of tiles correct (— and |) + no tiles used
     # Subtract 1 for every incorrect line, once per (row, column) pair
     # Subtract 1 for every tile used
+    @cached_fitness
     def ff_line_match_first(self):
         self.perfect_score = self.pattern_size ** 2 + self.pattern_size * 2
         self.score = self.perfect_score
-        self.incorrect = 0
-        self.tile_color_map = {}
-        self.assembly = self.seed_assembly.assemble(self.gluetable)
-
-        for r in range(1, self.assembly.size):
-            for c in range(1, self.assembly.size):
-                color = self.pattern[(
-                    (self.pattern_size - r) * self.pattern_size) + (c - 1)]
-                tile = self.assembly.tile_at(r, c)
-
-                if tile not in self.tile_color_map:
-                    self.tile_color_map[tile] = color
-
-        wrong = {}
-        for r in range(1, self.assembly.size):
-            for c in range(1, self.assembly.size):
-                color = self.pattern[(
-                    (self.pattern_size - r) * self.pattern_size) + (c - 1)]
-                tile = self.assembly.tile_at(r, c)
-                tile_color = self.tile_color_map[tile]
-
-                if tile_color != color and (r, c) not in wrong:
-                    self.incorrect += 1
-                    wrong[(r, c)] = 1
-                    break
-
-        for c in range(1, self.assembly.size):
-            for r in range(1, self.assembly.size):
-                color = self.pattern[(
-                    (self.pattern_size - r) * self.pattern_size) + (c - 1)]
-                tile = self.assembly.tile_at(r, c)
-                tile_color = self.tile_color_map[tile]
-
-                if tile_color != color and (r, c) not in wrong:
-                    self.incorrect += 1
-                    wrong[(r, c)] = 1
-                    break
+        wrong = self.match_first().reshape(self.pattern_size, self.pattern_size)
+
+        # every row counts its first wrong cell, every column its first wrong
+        # cell not already counted by a row
+        row_first = wrong & (np.cumsum(wrong, axis=1) == 1)
+        self.incorrect = int(wrong.any(axis=1).sum()
+                             + (wrong & ~row_first).any(axis=0).sum())
 
         self.score -= self.incorrect
-        self.score -= len(self.tile_color_map)
+        self.score -= self.tileset_size
         return self.score
 
     # Perfect score: every color correct + no tiles used
     # Subtract 1 for every incorrect color
     # Subtract 1 for every tile used
+    @cached_fitness
     def ff_pattern_match_first(self):
         self.perfect_score = self.pattern_size ** 2 * 2
         self.score = self.perfect_score
-        self.incorrect = 0
-        self.tile_color_map = {}
-        self.assembly = self.seed_assembly.assemble(self.gluetable)
-
-        for r in range(1, self.assembly.size):
-            for c in range(1, self.assembly.size):
-                color = self.pattern[(
-                    (self.pattern_size - r) * self.pattern_size) + (c - 1)]
-                tile = self.assembly.tile_at(r, c)
-
-                if tile not in self.tile_color_map:
-                    self.tile_color_map[tile] = color
-                elif self.tile_color_map[tile] != color:
-                    self.incorrect += 1
+        self.incorrect = int(self.match_first().sum())
 
         self.score -= self.incorrect
-        self.score -= len(self.tile_color_map)
+        self.score -= self.tileset_size
         return self.score
 
     # Perfect score: every color correct + no tiles used
     # Subtract 1 for every incorrect color
     # Subtract 1 for every tile used over the limit
+    @cached_fitness
     def ff_pattern_match_first_tile_limit(self):
         self.perfect_score = self.pattern_size ** 2 * 2
         self.score = self.perfect_score
-        self.incorrect = 0
-        self.tile_color_map = {}
-        self.assembly = self.seed_assembly.assemble(self.gluetable)
-
-        for r in range(1, self.assembly.size):
-            for c in range(1, self.assembly.size):
-                color = self.pattern[(
-                    (self.pattern_size - r) * self.pattern_size) + (c - 1)]
-                tile = self.assembly.tile_at(r, c)
-
-                if tile not in self.tile_color_map:
-                    self.tile_color_map[tile] = color
-                elif self.tile_color_map[tile] != color:
-                    self.incorrect += 1
+        self.incorrect = int(self.match_first().sum())
 
         self.score -= self.incorrect
-        self.score -= len(self.tile_color_map)
-        if len(self.tile_color_map) > self.tileset_size_limit:
-            self.score -= len(self.tile_color_map) - self.tileset_size_limit
+        self.score -= self.tileset_size
+        if self.tileset_size > self.tileset_size_limit:
+            self.score -= self.tileset_size - self.tileset_size_limit
         return self.score
 
     # Perfect score: every color correct + no tiles used
     # Subtract 1 for every incorrect color
     # Subtract 1 for every tile used
+    @cached_fitness
     def ff_pattern_match_best(self):
         self.perfect_score = self.pattern_size ** 2 * 2
         self.score = self.perfect_score
-        self.incorrect = 0
-        self.tile_color_map = {}
-        self.assembly = self.seed_assembly.assemble(self.gluetable)
-
-        for r in range(1, self.assembly.size):
-            for c in range(1, self.assembly.size):
-                color = self.pattern[(
-                    (self.pattern_size - r) * self.pattern_size) + (c - 1)]
-                tile = self.assembly.tile_at(r, c)
-
-                if tile not in self.tile_color_map:
-                    if color == 'b':
-                        entry = (1, 0)
-                    elif color == 'w':
-                        entry = (0, 1)
-                    else:
-                        quit()
-
-                    self.tile_color_map[tile] = entry
-                else:
-                    if color == 'b':
-                        entry = self.tile_color_map[tile]
-                        self.tile_color_map[tile] = (entry[0] + 1, entry[1])
-                    elif color == 'w':
-                        entry = self.tile_color_map[tile]
-                        self.tile_color_map[tile] = (entry[0], entry[1] + 1)
-                    else:
-                        quit()
-
-        for t in self.tile_color_map.keys():
-            b_count, w_count = self.tile_color_map[t]
-
-            if b_count >= w_count:
-                self.tile_color_map[t] = 'b'
-                self.incorrect += w_count
-            else:
-                self.tile_color_map[t] = 'w'
-                self.incorrect += b_count
+        self.incorrect = self.match_best()
 
         self.score -= self.incorrect
-        self.score -= len(self.tile_color_map)
+        self.score -= self.tileset_size
         return self.score
 
     # Perfect score: every color correct + no tiles used
     # Subtract 1 for every incorrect color
     # Subtract 1 for every tile used
+    @cached_fitness
     def ff_pattern_match_best_tile_limit(self):
         self.perfect_score = self.pattern_size ** 2 * 2
         self.score = self.perfect_score
-        self.incorrect = 0
-        self.tile_color_map = {}
-        self.assembly = self.seed_assembly.assemble(self.gluetable)
-
-        for r in range(1, self.assembly.size):
-            for c in range(1, self.assembly.size):
-                color = self.pattern[(
-                    (self.pattern_size - r) * self.pattern_size) + (c - 1)]
-                tile = self.assembly.tile_at(r, c)
-
-                if tile not in self.tile_color_map:
-                    if color == 'b':
-                        entry = (1, 0)
-                    elif color == 'w':
-                        entry = (0, 1)
-                    else:
-                        quit()
-
-                    self.tile_color_map[tile] = entry
-                else:
-                    if color == 'b':
-                        entry = self.tile_color_map[tile]
-                        self.tile_color_map[tile] = (entry[0] + 1, entry[1])
-                    elif color == 'w':
-                        entry = self.tile_color_map[tile]
-                        self.tile_color_map[tile] = (entry[0], entry[1] + 1)
-                    else:
-                        quit()
-
-        for t in self.tile_color_map.keys():
-            b_count, w_count = self.tile_color_map[t]
-
-            if b_count >= w_count:
-                self.tile_color_map[t] = 'b'
-                self.incorrect += w_count
-            else:
-                self.tile_color_map[t] = 'w'
-                self.incorrect += b_count
+        self.incorrect = self.match_best()
 
         self.score -= self.incorrect
-        self.score -= len(self.tile_color_map)
-        if len(self.tile_color_map) > self.tileset_size_limit:
-            self.score -= len(self.tile_color_map) - self.tileset_size_limit
+        self.score -= self.tileset_size
+        if self.tileset_size > self.tileset_size_limit:
+            self.score -= self.tileset_size - self.tileset_size_limit
         return self.score
 
-    def mutate(self):
-        result = copy.deepcopy(self)
+    # rates replaces the child's (mutation_rate, seed_mutation_rate) before it
+    # is mutated, rng is the child's stream when the run has one
+    def mutate(self, rates=None, rng=None):
+        result = self.copy()
+        if rates is not None:
+            result.mutation_rate, result.seed_mutation_rate = rates
+        if rng is None:
+            rng = numpy_rng()
 
         # mutate gluetable
-        for s in range(1, result.gluetable.max_glues + 1):
-            for w in range(1, result.gluetable.max_glues + 1):
-                north, east = result.gluetable.glues_at(s, w)
-
-                mutation_change = random.random()
-                if mutation_change <= result.mutation_rate:
-                    north = random.randint(1, result.gluetable.max_glues)
-                mutation_change = random.random()
-                if mutation_change <= result.mutation_rate:
-                    east = random.randint(1, result.gluetable.max_glues)
-
-                result.gluetable.set_glues_at(s, w, (north, east))
+        # the focused strategy always needs the parent's grid, the others use
+        # it only when it is at hand
+        parent = None
+        if result.mutation_strategy == "focused" or (
+                self.assembled is not None and self.assembled[0] == self.gluetable.version):
+            parent = self.assemble()
+        if result.mutation_strategy == "uniform":
+            changed = result.gluetable.mutate(result.mutation_rate, rng)
+        elif result.mutation_strategy == "focused":
+            consulted = np.unique(parent.pairs())
+            # lazy tables forget entries the parent never read, so they stay
+            # within one override per assembled cell
+            if not result.gluetable.dense:
+                result.gluetable.retain(consulted)
+            changed = result.gluetable.mutate_sparse(
+                result.mutation_rate, rng, consulted)
+        else:
+            changed = result.gluetable.mutate_sparse(result.mutation_rate, rng)
 
         # mutate seed
-        for r in range(1, result.seed_assembly.size):
-            mutation_change = random.random()
-            if mutation_change <= result.seed_mutation_rate:
-                result.seed_assembly.update_at(r, 0, Tile(
-                    east=random.randint(1, result.gluetable.max_glues)))
-
-        for c in range(1, result.seed_assembly.size):
-            mutation_change = random.random()
-            if mutation_change <= result.seed_mutation_rate:
-                result.seed_assembly.update_at(0, c, Tile(
-                    north=random.randint(1, result.gluetable.max_glues)))
+        mask = rng.random(result.seed_tiles.shape) <= result.seed_mutation_rate
+        replacement = rng.integers(
+            1, result.max_glues, size=result.seed_tiles.shape,
+            dtype=result.seed_tiles.dtype, endpoint=True)
+        changed_seeds = np.flatnonzero(mask & (replacement != result.seed_tiles))
+        np.copyto(result.seed_tiles, replacement, where=mask)
+
+        # record the cells reading a changed entry and the changed seed glues,
+        # so the child can be assembled from this grid
+        if parent is not None:
+            pairs = parent.pairs()
+            changed_cells = np.zeros(pairs.shape, dtype=bool)
+            if len(changed):
+                found = np.searchsorted(changed, pairs)
+                changed_cells = changed[np.minimum(found, len(changed) - 1)] == pairs
+            result.lineage = (result.gluetable.version, parent,
+                              changed_cells, changed_seeds)
 
         return result
 
+    # Child of two parents: a block of consecutive south glues of the glue
+    # table comes from other, and each seed edge from either parent
+    def crossover(self, other, rng=None):
+        result = self.copy()
+        if rng is None:
+            rng = numpy_rng()
+        low, high = np.sort(rng.integers(1, self.max_glues + 2, size=2))
+        result.gluetable.crossover(other.gluetable, low, high)
+        west, south = rng.random(2) < 0.5
+        if west:
+            result.seed_tiles[:self.pattern_size] = other.seed_tiles[:self.pattern_size]
+        if south:
+            result.seed_tiles[self.pattern_size:] = other.seed_tiles[self.pattern_size:]
+        return result
+
 
 #
 # GlueTable
 #
 class GlueTable:
-    def __init__(self, max_glues):
+    dense = True
+
+    def __init__(self, max_glues, rng=None):
         self.max_glues = max_glues
-        # Flattened 2D array, each entry is a tuple of glues (north, east)
+        if rng is None:
+            rng = numpy_rng()
+        # 2D array indexed by (south, west), each entry holds the glues
+        # (north, east)
         # Add 1 to max_glues to accommodate values [0, self.max_glues]
-        self.gt = [(random.randint(1, self.max_glues),
-                    random.randint(1, self.max_glues))
-                   for _ in range((self.max_glues + 1) ** 2)]
+        shape = (self.max_glues + 1, self.max_glues + 1, 2)
+        dtype = glue_dtype(self.max_glues)
+        self.glues = rng.integers(
+            1, self.max_glues, size=shape, dtype=dtype, endpoint=True)
+        # bumped on every write, so cached scores can tell the table changed
+        self.version = 0
+
+    @property
+    def north(self):
+        return self.glues[..., 0]
+
+    @property
+    def east(self):
+        return self.glues[..., 1]
+
+    @property
+    def nbytes(self):
+        return self.glues.nbytes
+
+    # (..., 2) glues of the given (south, west) glue arrays
+    def lookup(self, south, west):
+        return self.glues[south, west]
+
+    def copy(self):
+        result = GlueTable.__new__(GlueTable)
+        result.max_glues = self.max_glues
+        result.glues = self.glues.copy()
+        result.version = self.version
+        return result
+
+    def tobytes(self):
+        return self.glues.tobytes()
+
+    @classmethod
+    def frombuffer(cls, max_glues, data):
+        result = cls.__new__(cls)
+        result.max_glues = max_glues
+        shape = (max_glues + 1, max_glues + 1, 2)
+        result.glues = np.frombuffer(
+            data, dtype=glue_dtype(max_glues)).reshape(shape).copy()
+        result.version = 0
+        return result
+
+    def glues_at(self, x, y):
+        north, east = self.glues[x, y]
+        return int(north), int(east)
+
+    def set_glues_at(self, x, y, g):
+        self.glues[x, y] = g
+        self.version += 1
+
+    # Take the entries of south glues [low, high) from other
+    def crossover(self, other, low, high):
+        self.glues[low:high] = other.glues[low:high]
+        self.version += 1
+
+    # Replace every entry with probability mutation_rate, independently for the
+    # north and east side: one Bernoulli mask and one replacement array per side
+    # Returns the sorted (south, west) pairs whose glues changed, as
+    # south * (max_glues + 1) + west
+    def mutate(self, mutation_rate, rng):
+        changed = np.zeros(self.glues.shape[:2], dtype=bool)
+        for side in (self.north, self.east):
+            # glue 0 is never looked up, only entries [1, max_glues] mutate
+            entries = side[1:, 1:]
+            mask = rng.random(entries.shape) <= mutation_rate
+            replacement = rng.integers(
+                1, self.max_glues, size=entries.shape, dtype=side.dtype,
+                endpoint=True)
+            changed[1:, 1:] |= mask & (replacement != entries)
+            np.copyto(entries, replacement, where=mask)
+        self.version += 1
+        return np.flatnonzero(changed)
+
+    # Same per entry distribution as mutate, drawn sparsely: the number of
+    # replaced glues per side is binomial, then only that many positions are
+    # drawn. pairs restricts the candidates to the given (south, west) pairs,
+    # all entries otherwise. Returns the sorted pairs whose glues changed.
+    def mutate_sparse(self, mutation_rate, rng, pairs=None):
+        base = self.max_glues + 1
+        candidates = self.max_glues ** 2 if pairs is None else len(pairs)
+        changed = []
+        for side in (self.north, self.east):
+            count = rng.binomial(candidates, mutation_rate)
+            positions = rng.choice(candidates, count, replace=False)
+            if pairs is None:
+                south, west = np.divmod(positions, self.max_glues)
+                south += 1
+                west += 1
+            else:
+                south, west = np.divmod(pairs[positions], base)
+            replacement = rng.integers(
+                1, self.max_glues, size=count, dtype=side.dtype, endpoint=True)
+            moved = replacement != side[south, west]
+            side[south, west] = replacement
+            changed.append(south[moved] * base + west[moved])
+        self.version += 1
+        return np.union1d(*changed)
+
+
+#
+# LazyGlueTable
+#
+# Same interface as GlueTable for glue tables too large to hold densely. An
+# entry nobody wrote comes from a hash of its (south, west) pair under the
+# table's key, written entries are kept as sorted pair ids with their glues.
+# Writes replace the override arrays instead of changing them, so copies can
+# share them.
+#
+class LazyGlueTable:
+    dense = False
+
+    def __init__(self, max_glues, rng=None):
+        self.max_glues = max_glues
+        if rng is None:
+            rng = numpy_rng()
+        self.key = int(rng.integers(0, 1 << 63))
+        self.pairs = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros((0, 2), dtype=glue_dtype(max_glues))
+        self.version = 0
+
+    @property
+    def nbytes(self):
+        return 8 + self.pairs.nbytes + self.values.nbytes
+
+    def copy(self):
+        result = LazyGlueTable.__new__(LazyGlueTable)
+        result.max_glues = self.max_glues
+        result.key = self.key
+        result.pairs = self.pairs
+        result.values = self.values
+        result.version = self.version
+        return result
+
+    # The key, then the override pair ids and their glues
+    def tobytes(self):
+        return (np.uint64(self.key).tobytes() + self.pairs.tobytes()
+                + self.values.tobytes())
+
+    @classmethod
+    def frombuffer(cls, max_glues, data):
+        result = cls.__new__(cls)
+        result.max_glues = max_glues
+        dtype = glue_dtype(max_glues)
+        result.key = int(np.frombuffer(data[:8], dtype=np.uint64)[0])
+        count = (len(data) - 8) // (8 + 2 * dtype.itemsize)
+        result.pairs = np.frombuffer(
+            data[8:8 + count * 8], dtype=np.int64).copy()
+        result.values = np.frombuffer(
+            data[8 + count * 8:], dtype=dtype).reshape(count, 2).copy()
+        result.version = 0
+        return result
+
+    # (k, 2) glues of k pair ids
+    def lookup_pairs(self, pairs):
+        hashed = hash_pairs(self.key, pairs)
+        result = np.empty(pairs.shape + (2,), dtype=self.values.dtype)
+        result[..., 0] = hashed % np.uint64(self.max_glues) + np.uint64(1)
+        result[..., 1] = (hashed >> np.uint64(32)) % np.uint64(self.max_glues) + \
+            np.uint64(1)
+        if len(self.pairs):
+            found = np.minimum(np.searchsorted(self.pairs, pairs),
+                               len(self.pairs) - 1)
+            hit = self.pairs[found] == pairs
+            result[hit] = self.values[found[hit]]
+        return result
+
+    def lookup(self, south, west):
+        return self.lookup_pairs(
+            south.astype(np.int64) * (self.max_glues + 1) + west)
+
+    # Write glues for distinct pair ids, replacing earlier overrides
+    def assign(self, pairs, values):
+        pairs = np.concatenate((pairs, self.pairs))
+        values = np.concatenate((values, self.values))
+        self.pairs, first = np.unique(pairs, return_index=True)
+        self.values = values[first]
+
+    # Drop the overrides of every pair not in the sorted pairs, those entries
+    # go back to their hashed glues
+    def retain(self, pairs):
+        if len(self.pairs):
+            keep = np.isin(self.pairs, pairs, assume_unique=True)
+            self.pairs = self.pairs[keep]
+            self.values = self.values[keep]
+            self.version += 1
 
     def glues_at(self, x, y):
-        return self.gt[(x * self.max_glues) + y]
+        north, east = self.lookup(np.array([x]), np.array([y]))[0]
+        return int(north), int(east)
 
     def set_glues_at(self, x, y, g):
-        self.gt[(x * self.max_glues) + y] = g
+        self.assign(np.array([x * (self.max_glues + 1) + y]),
+                    np.array([g], dtype=self.values.dtype))
+        self.version += 1
+
+    # Take the overrides of south glues [low, high) from other, the hashed
+    # entries there stay this table's own
+    def crossover(self, other, low, high):
+        base = self.max_glues + 1
+        mine = (self.pairs < low * base) | (self.pairs >= high * base)
+        theirs = (other.pairs >= low * base) & (other.pairs < high * base)
+        pairs = np.concatenate((self.pairs[mine], other.pairs[theirs]))
+        order = np.argsort(pairs)
+        self.pairs = pairs[order]
+        self.values = np.concatenate(
+            (self.values[mine], other.values[theirs]))[order]
+        self.version += 1
+
+    # Every entry is a candidate, drawn the sparse way
+    def mutate(self, mutation_rate, rng):
+        return self.mutate_sparse(mutation_rate, rng)
+
+    # Draws exactly like GlueTable.mutate_sparse
+    def mutate_sparse(self, mutation_rate, rng, pairs=None):
+        base = self.max_glues + 1
+        candidates = self.max_glues ** 2 if pairs is None else len(pairs)
+        changed = []
+        for side in (0, 1):
+            count = rng.binomial(candidates, mutation_rate)
+            positions = rng.choice(candidates, count, replace=False)
+            if pairs is None:
+                south, west = np.divmod(positions, self.max_glues)
+                positions = (south + 1) * base + west + 1
+            else:
+                positions = pairs[positions]
+            replacement = rng.integers(
+                1, self.max_glues, size=count, dtype=self.values.dtype,
+                endpoint=True)
+            glues = self.lookup_pairs(positions)
+            moved = replacement != glues[:, side]
+            glues[:, side] = replacement
+            self.assign(positions, glues)
+            changed.append(positions[moved])
+        self.version += 1
+        return np.union1d(*changed)
 
 
 #
@@ -597,7 +2454,7 @@ if __name__ == "__main__":
             data = file.read()
             pattern = data.split()
 
-    pats = PATS_Approximator(pattern, 250)
+    pats = PATS_Approximator(pattern, 250, ff_pattern_match_first)
 
     # number of generations
     generations = 25
@@ -611,3 +2468,4 @@ if __name__ == "__main__":
         print(f"Generation {g + 1} / {generations}")
     print()
     pats.print_best()
+    pats.close()
@@ -0,0 +1,148 @@
+import argparse
+import concurrent.futures
+import itertools
+import os
+import time
+
+import numpy as np
+
+from main import PATS_Approximator, StoppingCriteria, FITNESS_FUNCTIONS, read_pattern
+from main import new_run_id
+
+
+#
+# Sweep
+#
+# Runs every combination of pattern, fitness function, population size,
+# mutation rate and seed in a process pool and collects one summary row per
+# run into sweeps/<sweep id>/summary.npz, one array per column. Run ids are
+# the sweep id plus the index in the grid, so they never collide. Runs end
+# early when the stopping criteria are met, generations holds how many ran.
+#
+SUMMARY_COLUMNS = ("run_id", "pattern", "ff", "population_size",
+                   "mutation_rate", "seed", "generations", "best_score",
+                   "tileset_size_limit", "incorrect", "tileset_size",
+                   "first_perfect_generation", "stop_reason", "evaluations",
+                   "seconds")
+
+
+def run_one(run_id, pattern_file, ff_name, population_size, mutation_rate,
+            seed, generations, data_every, stopping=None, solutions=None):
+    start = time.perf_counter()
+    pats = PATS_Approximator(read_pattern(pattern_file), population_size,
+                             FITNESS_FUNCTIONS[ff_name],
+                             mutation_rate=mutation_rate, random_seed=seed,
+                             run_id=run_id, stopping=stopping,
+                             solutions=solutions)
+    stop_reason = pats.run(generations, data_every)
+    pats.close()
+
+    # after a generation the best scored organism leads the new population
+    best = pats.population[0]
+    return {
+        "run_id": run_id,
+        "pattern": pattern_file,
+        "ff": ff_name,
+        "population_size": population_size,
+        "mutation_rate": mutation_rate,
+        "seed": seed,
+        "generations": pats.generation,
+        "best_score": pats.best_score,
+        "tileset_size_limit": pats.tileset_size_limit,
+        "incorrect": best.incorrect,
+        "tileset_size": best.tileset_size,
+        "first_perfect_generation": pats.first_perfect_generation,
+        "stop_reason": stop_reason,
+        "evaluations": pats.evaluations,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_sweep(pattern_files, ff_names, population_sizes, mutation_rates,
+              seeds, generations, jobs=None, data_every=10,
+              directory="sweeps", stopping=None, solutions=None):
+    sweep_id = new_run_id()
+    grid = list(itertools.product(pattern_files, ff_names, population_sizes,
+                                  mutation_rates, seeds))
+    print(f"Sweep {sweep_id}: {len(grid)} runs")
+
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(run_one, f"{sweep_id}-{i:04}", *params,
+                               generations, data_every, stopping, solutions)
+                   for i, params in enumerate(grid)]
+        for future in concurrent.futures.as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            print(f"{len(rows)} / {len(grid)} {row['run_id']} "
+                  f"{row['ff']} {row['pattern']} score {row['best_score']} "
+                  f"tileset {row['tileset_size_limit']} "
+                  f"stopped at {row['generations']}: {row['stop_reason']}")
+
+    rows.sort(key=lambda row: row["run_id"])
+    path = os.path.join(directory, sweep_id, "summary.npz")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, **{name: np.array([row[name] for row in rows])
+                      for name in SUMMARY_COLUMNS})
+    return path
+
+
+#
+# main
+#
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Run a grid of PATS experiments in parallel")
+    parser.add_argument("--patterns", nargs="+",
+                        default=["patterns/checkerboard_4.txt",
+                                 "patterns/lines_4.txt",
+                                 "patterns/random_4.txt",
+                                 "patterns/random_5.txt"])
+    parser.add_argument("--ff", nargs="+", choices=sorted(FITNESS_FUNCTIONS),
+                        default=list(FITNESS_FUNCTIONS))
+    parser.add_argument("--population-sizes", nargs="+", type=int,
+                        default=[200])
+    parser.add_argument("--mutation-rates", nargs="+", type=float,
+                        default=[0.25])
+    parser.add_argument("--seeds", nargs="+", type=int, default=None,
+                        help="random seeds of the replicates")
+    parser.add_argument("--replicates", type=int, default=1,
+                        help="seeds 0 .. N-1, when --seeds is not given")
+    parser.add_argument("--generations", type=int, default=2_000)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="runs at the same time")
+    parser.add_argument("--data-every", type=int, default=10,
+                        help="write_data interval, 0 to disable")
+    parser.add_argument("--target-score", type=int, default=None,
+                        help="stop a run once its best score reaches this")
+    parser.add_argument("--target-tileset-size", type=int, default=None,
+                        help="stop a run at a perfect assembly this small")
+    parser.add_argument("--patience", type=int, default=None,
+                        help="stop a run after this many generations "
+                             "without improvement")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="wall-clock budget per run")
+    parser.add_argument("--max-evaluations", type=int, default=None,
+                        help="fitness evaluation budget per run")
+    parser.add_argument("--solutions", default=None,
+                        help="solution store directory for perfect tilesets")
+    args = parser.parse_args(argv)
+
+    seeds = args.seeds
+    if seeds is None:
+        seeds = list(range(args.replicates))
+
+    path = run_sweep(args.patterns, args.ff, args.population_sizes,
+                     args.mutation_rates, seeds, args.generations, args.jobs,
+                     args.data_every,
+                     stopping=StoppingCriteria(args.target_score,
+                                               args.target_tileset_size,
+                                               args.patience, args.max_seconds,
+                                               args.max_evaluations),
+                     solutions=args.solutions)
+    print(f"Summary: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import sys
-from main import PATS_Approximator
+from main import PATS_Approximator, StoppingCriteria
 from main import ff_line_match_first, ff_pattern_match_best, ff_pattern_match_first, ff_pattern_match_best_tile_limit, ff_pattern_match_first_tile_limit
 
 #
@@ -15,6 +15,8 @@ if __name__ == "__main__":
 
     generations = 2_000
     population_size = 200
+    # stop once neither the score nor the tileset size improved for this long
+    patience = 500
 
     # patterns to try
     pattern_files = ["patterns/checkerboard_4.txt",
@@ -47,13 +49,11 @@ if __name__ == "__main__":
         ff = ff_pattern_match_first
 
     for p in patterns:
-        pats = PATS_Approximator(p, population_size, ff)
+        pats = PATS_Approximator(p, population_size, ff,
+                                 stopping=StoppingCriteria(patience=patience))
         print(f"ID: {pats.id}")
 
         # run the algorithm
-        for g in range(generations):
-            pats.run_generation()
-            if g % 100 == 0:
-                print(f"Generation {g + 1} / {generations}")
-            if g % 10 == 0:
-                pats.write_data()
+        reason = pats.run(generations, data_every=10, print_every=100)
+        print(f"Stopped at generation {pats.generation}: {reason}")
+        pats.close()